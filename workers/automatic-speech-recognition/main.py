@@ -4,29 +4,36 @@
 import os
 import io
 import sys
+import json
 import time
+import queue
 import base64
+import shutil
+import struct
+import soxr
 import logging
-import librosa
 import uvicorn
 import zipfile
 import platform
 import requests
 import argparse
 import subprocess
+import collections
 import urllib.parse
-import openvino_genai
+import numpy as np
+import soundfile as sf
 import huggingface_hub
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
-import openvino as ov
 from typing import Dict
 from fastapi import FastAPI
 from pydantic import BaseModel
 from dotenv import load_dotenv
-from contextlib import asynccontextmanager
-from fastapi.responses import JSONResponse
+from contextlib import asynccontextmanager, contextmanager
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
+from starlette.concurrency import run_in_threadpool
 from modelscope.hub.snapshot_download import snapshot_download
 
 
@@ -36,9 +43,34 @@ logging.basicConfig(
 )
 
 MODELS_DIR = Path("models")
+OV_CACHE_DIR = MODELS_DIR / "ov_cache"
 CUSTOM_MODEL_DIR = Path("../custom_models/automatic-speech-recognition")
 ENV_PATH = Path("../../frontend/.env")
-PIPE = None
+# Idle WhisperPipeline replicas, each serves one request at a time
+PIPELINES = queue.Queue()
+DOWNLOAD_WORKERS = 8
+
+# Keep-alive connection to the frontend for status updates
+STATUS_SESSION = requests.Session()
+STATUS_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+)
+SAMPLE_RATE = 16000
+# Data URL MIME types that skip audio decoding and resampling. "audio/l16"
+# carries raw little-endian 16-bit mono samples at 16 kHz; "audio/wav" takes
+# the fast path only when the header is canonical 16 kHz mono 16-bit PCM.
+RAW_PCM_MIME_TYPE = "audio/l16;rate=16000"
+WAV_MIME_TYPE = "audio/wav"
+WAV_HEADER_SIZE = 44
+# Whisper encoder input: one 30 s window of 10 ms log-mel frames
+ENCODER_MODEL_XML = "openvino_encoder_model.xml"
+ENCODER_INPUT_NAME = "input_features"
+ENCODER_NUM_FRAMES = 3000
+DEFAULT_NUM_MEL_BINS = 80
+# Long audio is split into 30 s windows with a 2 s overlap
+CHUNK_SAMPLES = SAMPLE_RATE * 30
+CHUNK_STRIDE = SAMPLE_RATE * 28
+MAX_OVERLAP_WORDS = 8
 
 
 def setup_env():
@@ -46,10 +78,7 @@ def setup_env():
 
     env = os.environ.copy()
     venv_path = Path(sys.executable).parent
-    if platform.system() == "Windows":
-        env["PATH"] = f"{venv_path};{env['PATH']}"
-    else:
-        env["PATH"] = f"{venv_path}:{env['PATH']}"
+    env["PATH"] = f"{venv_path}{os.pathsep}{env['PATH']}"
     return env
 
 
@@ -59,27 +88,43 @@ def optimum_cli(
     env: Dict[str, str],
     additional_args: Dict[str, str] = None,
 ):
-    if args.repo_source == "huggingface":
-        export_command = (
-            f"optimum-cli export openvino --model {args.model_name} {output_dir}"
-        )
-    else:
-        export_command = (
-            f"optimum-cli export openvino --model {output_dir} {output_dir}"
-        )
+    """
+    Export the model to OpenVINO IR with optimum-cli in a child process, so
+    torch and the checkpoint are released once the export finishes.
+    """
+    model = args.model_name if args.repo_source == "huggingface" else output_dir
+    optimum = shutil.which("optimum-cli", path=env.get("PATH")) or "optimum-cli"
+    export_command = [
+        optimum,
+        "export",
+        "openvino",
+        "--model",
+        str(model),
+        str(output_dir),
+    ]
     if additional_args is not None:
         for arg, value in additional_args.items():
-            export_command += f" --{arg}"
+            export_command.append(f"--{arg}")
             if value:
-                export_command += f" {value}"
+                export_command.append(str(value))
     try:
-        subprocess.run(
-            export_command.split(" "),
-            shell=(platform.system() == "Windows"),
-            check=True,
-            capture_output=True,
+        output_tail = collections.deque(maxlen=200)
+        with subprocess.Popen(
+            export_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
             env=env,
-        )
+        ) as process:
+            for line in process.stdout:
+                line = line.rstrip()
+                logging.info(line)
+                output_tail.append(line)
+        if process.returncode != 0:
+            logging.error("\n".join(output_tail))
+            raise subprocess.CalledProcessError(process.returncode, export_command)
     except Exception as e:
         logging.error(f"optimum-cli failed: {e}")
         update_payload_status(args.id, status="failed", port=args.port)
@@ -122,20 +167,217 @@ def update_payload_status(workload_id: int, status: str, port: int):
 
     data = {"status": status, "port": port}
     try:
-        response = requests.patch(url, json=data)
+        response = STATUS_SESSION.patch(url, json=data, timeout=2)
         response.raise_for_status()
         logging.info(f"Successfully updated status to {status} for {workload_id}.")
     except requests.exceptions.RequestException as e:
         logging.info(f"Failed to update status: {e}")
 
 
-def setup_model(args: argparse.Namespace, env: Dict[str, str]):
-    global PIPE
+def decode_data_url(data_url: str):
+    """
+    Split a base64 data URL into its MIME type and decoded payload.
+    """
+    separator = data_url.find(",")
+    if separator == -1:
+        raise ValueError("Audio file is not a base64 data URL")
+    mime_type = data_url[:separator].removeprefix("data:")
+    # Decode from a view of the encoded payload so the base64 text is not
+    # copied again by slicing
+    payload = memoryview(data_url.encode("ascii"))[separator + 1 :]
+    return mime_type, base64.b64decode(payload)
+
+
+def decode_pcm16(mime_type: str, audio_data: bytes):
+    """
+    Convert 16 kHz mono 16-bit PCM audio to float32 samples without resampling.
+    Returns None if the payload is not in a format supported by the fast path.
+    """
+    mime_type = mime_type.lower()
+    if mime_type.startswith(RAW_PCM_MIME_TYPE):
+        pcm = audio_data
+    elif mime_type.startswith(WAV_MIME_TYPE):
+        if len(audio_data) < WAV_HEADER_SIZE:
+            return None
+        riff, _, wave, fmt, fmt_size, audio_format, channels, sample_rate = (
+            struct.unpack_from("<4sI4s4sIHHI", audio_data)
+        )
+        bits_per_sample = struct.unpack_from("<H", audio_data, 34)[0]
+        data_tag = audio_data[36:40]
+        if (
+            riff != b"RIFF"
+            or wave != b"WAVE"
+            or fmt != b"fmt "
+            or fmt_size != 16
+            or audio_format != 1
+            or channels != 1
+            or sample_rate != SAMPLE_RATE
+            or bits_per_sample != 16
+            or data_tag != b"data"
+        ):
+            return None
+        pcm = audio_data[WAV_HEADER_SIZE:]
+    else:
+        return None
+
+    # Drop a trailing odd byte rather than failing on a truncated sample
+    pcm = pcm[: len(pcm) - (len(pcm) % 2)]
+    return np.frombuffer(pcm, dtype="<i2").astype(np.float32) * (1.0 / 32768.0)
+
+
+def load_audio(audio_file: io.BytesIO):
+    """
+    Decode an audio file to mono float32 samples at the Whisper sample rate.
+    """
+    try:
+        data, sample_rate = sf.read(audio_file, dtype="float32", always_2d=False)
+    except sf.LibsndfileError:
+        # libsndfile cannot decode some containers (e.g. m4a), fall back to librosa
+        import librosa
+
+        audio_file.seek(0)
+        data, _ = librosa.load(audio_file, sr=SAMPLE_RATE)
+        return data
+
+    if data.ndim == 2:
+        data = data.mean(axis=1)
+    if sample_rate != SAMPLE_RATE:
+        data = soxr.resample(data, sample_rate, SAMPLE_RATE, quality="HQ")
+    return data
+
+
+def specialize_encoder_shape(model_path: Path):
+    """
+    Reshape the exported Whisper encoder to a static single 30 s window so it
+    compiles without dynamic dimensions. The model is rewritten in place once, so
+    only call it on models in MODELS_DIR.
+    """
+    import openvino as ov
+
+    encoder_xml = model_path / ENCODER_MODEL_XML
+    if not encoder_xml.is_file():
+        return
+
+    encoder = ov.Core().read_model(encoder_xml)
+    input_shape = encoder.input(ENCODER_INPUT_NAME).get_partial_shape()
+    if input_shape.is_static:
+        return
+
+    if input_shape[1].is_static:
+        num_mel_bins = input_shape[1].get_length()
+    else:
+        preprocessor_config = model_path / "preprocessor_config.json"
+        num_mel_bins = DEFAULT_NUM_MEL_BINS
+        if preprocessor_config.is_file():
+            with open(preprocessor_config, "r", encoding="utf-8") as f:
+                num_mel_bins = json.load(f).get("feature_size", DEFAULT_NUM_MEL_BINS)
+
+    static_shape = [1, num_mel_bins, ENCODER_NUM_FRAMES]
+    logging.info(f"Reshaping {encoder_xml} input to static shape {static_shape}")
+    encoder.reshape({ENCODER_INPUT_NAME: static_shape})
+
+    # Write next to the original and swap, the weights are memory-mapped
+    static_xml = encoder_xml.with_name(f"{encoder_xml.stem}_static.xml")
+    ov.save_model(encoder, str(static_xml), compress_to_fp16=False)
+    del encoder
+    try:
+        os.replace(static_xml.with_suffix(".bin"), encoder_xml.with_suffix(".bin"))
+        os.replace(static_xml, encoder_xml)
+    finally:
+        # Nothing is left over after a successful swap, a failed one (e.g. the
+        # mapped .bin on Windows) must not leave the static copy behind
+        static_xml.unlink(missing_ok=True)
+        static_xml.with_suffix(".bin").unlink(missing_ok=True)
+
+
+def pipeline_properties(device: str):
+    """
+    Return the OpenVINO properties used to construct the pipeline on the device.
+    """
+    # GPU/NPU compilation dominates startup, so reuse the compiled blobs the
+    # plugin exports to CACHE_DIR. CPU compiles quickly from the memory-mapped
+    # IR and caching would only duplicate the weights on disk.
+    if any(accelerator in device.upper() for accelerator in ("GPU", "NPU")):
+        return {"CACHE_DIR": str(OV_CACHE_DIR)}
+    return {}
+
+
+def warmup_pipeline(pipe):
+    """
+    Run one second of silence through the pipeline so kernel compilation and
+    weight upload happen at startup instead of on the first request.
+    """
+    try:
+        pipe.generate(
+            np.zeros(SAMPLE_RATE, dtype=np.float32),
+            task="transcribe",
+            language="<|en|>",
+        )
+    except Exception as e:
+        logging.warning(f"Pipeline warmup failed: {e}")
+
+
+@contextmanager
+def borrow_pipeline():
+    """
+    Take an idle pipeline replica for the duration of a request.
+    """
+    pipe = PIPELINES.get()
+    try:
+        yield pipe
+    finally:
+        PIPELINES.put(pipe)
+
+
+def extract_member(
+    zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, destination: Path
+):
+    """
+    Stream a single zip member to disk, skipping files that are already extracted.
+    """
+    target = (destination / member.filename).resolve()
+    if not target.is_relative_to(destination):
+        raise ValueError(f"Zip member {member.filename} escapes {destination}")
+
+    if member.is_dir():
+        target.mkdir(parents=True, exist_ok=True)
+        return
+
+    try:
+        if target.stat().st_size == member.file_size:
+            return
+    except FileNotFoundError:
+        pass
+
+    target.parent.mkdir(parents=True, exist_ok=True)
+    with zip_ref.open(member) as src, open(target, "wb") as dst:
+        shutil.copyfileobj(src, dst, length=1 << 20)
+
+
+def extract_zip(zip_path: Path, destination: Path):
+    """
+    Extract a zip archive with one thread per member, zlib releases the GIL
+    while inflating so members decompress in parallel.
+    """
+    destination = destination.resolve()
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        members = zip_ref.infolist()
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(
+                executor.map(
+                    lambda member: extract_member(zip_ref, member, destination),
+                    members,
+                )
+            )
+
+
+def prepare_model(args: argparse.Namespace, env: Dict[str, str]):
+    """
+    Extract, download or export the model as needed and return its directory.
+    """
     # Prepare model path and extraction if needed
     MODELS_DIR.mkdir(exist_ok=True)
-
-    core = ov.Core()
-    available_devices = core.available_devices
+    OV_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     # handle custom model in zip format
     if args.model_name.endswith(".zip"):
@@ -146,8 +388,7 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         if not model_path.exists():
             logging.info(f"Extracting {args.model_name} to {model_path}")
             try:
-                with zipfile.ZipFile(Path(args.model_name).resolve(), "r") as zip_ref:
-                    zip_ref.extractall(model_path)
+                extract_zip(Path(args.model_name).resolve(), model_path)
             except Exception as e:
                 logging.error(f"Failed to extract zip file {args.model_name}: {e}")
                 update_payload_status(args.id, status="failed", port=args.port)
@@ -199,10 +440,14 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
                 snapshot_download(
                     repo_id=args.model_name,
                     local_dir=str(model_path),
+                    max_workers=DOWNLOAD_WORKERS,
                 )
 
                 if not is_openvino_model:
-                    additional_args = {"task": "automatic-speech-recognition"}
+                    additional_args = {
+                        "task": "automatic-speech-recognition",
+                        "weight-format": args.quant,
+                    }
                     optimum_cli(args, model_path, env, additional_args)
 
             else:
@@ -212,12 +457,16 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
 
                 if is_openvino_model:
                     huggingface_hub.snapshot_download(
-                        args.model_name, local_dir=str(model_path)
+                        args.model_name,
+                        local_dir=str(model_path),
+                        max_workers=DOWNLOAD_WORKERS,
+                        etag_timeout=30,
                     )
                 else:
-                    additional_args = None
-                    if "NPU" in available_devices:
-                        additional_args = {"disable-stateful": None}
+                    additional_args = {"weight-format": args.quant}
+                    # NPU pipelines need a stateless export
+                    if "NPU" in args.device.upper():
+                        additional_args["disable-stateful"] = None
                     optimum_cli(args, model_path, env, additional_args)
 
         except Exception as e:
@@ -225,17 +474,39 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
             update_payload_status(args.id, status="failed", port=args.port)
             sys.exit(1)
 
-    if (
-        model_path.resolve() != model_path.absolute()
-    ):  # Check if the model path is a symlink
+    if model_path.is_symlink():  # Check if the model path is a symlink
         logging.error(
-            f"Model file {model_path} is a symlink or contains a symlink in its path. Refusing to open for security reasons."
+            f"Model file {model_path} is a symlink. Refusing to open for security reasons."
         )
         update_payload_status(args.id, status="failed", port=args.port)
         sys.exit(1)
 
+    return model_path
+
+
+def setup_model(args: argparse.Namespace, env: Dict[str, str]):
+    # OpenVINO is imported here rather than at module load so --help and
+    # argument parsing stay cheap and the multi-worker parent process, which
+    # only prepares the model, never loads the runtime
+    import openvino_genai
+
+    model_path = prepare_model(args, env)
+
+    # Only models the worker extracted, downloaded or exported are rewritten,
+    # uploaded custom models are left untouched
+    if model_path.resolve().is_relative_to(MODELS_DIR.resolve()):
+        try:
+            specialize_encoder_shape(model_path)
+        except Exception as e:
+            logging.warning(f"Failed to reshape encoder to a static shape: {e}")
+
     try:
-        PIPE = openvino_genai.WhisperPipeline(str(model_path), args.device)
+        for _ in range(args.num_pipelines):
+            pipe = openvino_genai.WhisperPipeline(
+                str(model_path), args.device, **pipeline_properties(args.device)
+            )
+            warmup_pipeline(pipe)
+            PIPELINES.put(pipe)
         update_payload_status(args.id, status="active", port=args.port)
     except Exception as e:
         logging.error(f"Failed to load model: {e}")
@@ -244,11 +515,87 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
 
 
 class Request(BaseModel):
+    # Base64 data URL. Send "data:audio/l16;rate=16000;base64,..." or a
+    # 16 kHz mono PCM16 "data:audio/wav;base64,..." to skip resampling.
     file: str
     task: str
     language: str
 
 
+def split_chunks(raw_speech: np.ndarray):
+    """
+    Split audio into 30 s windows that overlap by 2 s.
+    """
+    overlap = CHUNK_SAMPLES - CHUNK_STRIDE
+    return [
+        raw_speech[start : start + CHUNK_SAMPLES]
+        for start in range(0, max(len(raw_speech) - overlap, 1), CHUNK_STRIDE)
+    ]
+
+
+def merge_transcripts(texts):
+    """
+    Join chunk transcripts, dropping words repeated across the chunk overlap.
+    """
+
+    def normalize(word):
+        return word.lower().strip(".,!?;:\"'")
+
+    words = texts[0].split()
+    for text in texts[1:]:
+        next_words = text.split()
+        overlap = 0
+        for size in range(min(MAX_OVERLAP_WORDS, len(words), len(next_words)), 0, -1):
+            tail = [normalize(word) for word in words[-size:]]
+            head = [normalize(word) for word in next_words[:size]]
+            if tail == head:
+                overlap = size
+                break
+        words.extend(next_words[overlap:])
+    return " ".join(words)
+
+
+def generate_text(raw_speech: np.ndarray, task: str, language: str):
+    with borrow_pipeline() as pipe:
+        result = pipe.generate(raw_speech, task=task, language=language)
+    return result.texts[0]
+
+
+def transcribe(request: Request):
+    """
+    Decode the uploaded audio and run speech recognition on it.
+    """
+    mime_type, audio_data = decode_data_url(request.file)
+    raw_speech = decode_pcm16(mime_type, audio_data)
+    if raw_speech is None:
+        raw_speech = load_audio(io.BytesIO(audio_data))
+    # Pass the samples as a contiguous float32 array instead of a list of
+    # Python floats
+    raw_speech = np.ascontiguousarray(raw_speech, dtype=np.float32)
+    language = f"<|{request.language}|>"
+
+    start_time = time.perf_counter()
+    idle_pipelines = PIPELINES.qsize()
+    if len(raw_speech) > CHUNK_SAMPLES and idle_pipelines > 1:
+        # Spread 30 s windows across the idle replicas. A single replica gains
+        # nothing over the pipeline's own long-form decoding.
+        chunks = split_chunks(raw_speech)
+        max_workers = min(idle_pipelines, len(chunks))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            texts = list(
+                executor.map(
+                    lambda chunk: generate_text(chunk, request.task, language),
+                    chunks,
+                )
+            )
+        text = merge_transcripts(texts)
+    else:
+        text = generate_text(raw_speech, request.task, language)
+    inference_time = time.perf_counter() - start_time
+
+    return {"text": text, "generation_time_s": round(inference_time, 1)}
+
+
 def parse_args():
     parser = argparse.ArgumentParser(
         description="FastAPI server for OpenVINO automatic speech recognition model"
@@ -271,6 +618,25 @@ def parse_args():
         default="CPU",
         help="Device to run the model on (e.g., CPU, GPU, MYRIAD)",
     )
+    parser.add_argument(
+        "--quant",
+        type=str,
+        default="int8",
+        choices=["fp16", "int8", "int4"],
+        help="Weight format used when exporting the model to OpenVINO (default: int8)",
+    )
+    parser.add_argument(
+        "--num-pipelines",
+        type=int,
+        default=1,
+        help="Number of pipeline replicas serving concurrent requests (default: 1)",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Number of uvicorn worker processes (default: 1)",
+    )
     parser.add_argument(
         "--port", type=int, default=5997, help="Port to run the FastAPI server on"
     )
@@ -286,7 +652,7 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
         setup_model(args, env)
         yield
 
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
     app.add_middleware(
         CORSMiddleware,
@@ -298,24 +664,12 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
 
     @app.post("/infer")
     async def process_audio(request: Request):
-        global PIPE
         try:
-            file = request.file.split(",")[1]
-            audio_data = base64.b64decode(file)
-            audio_file = io.BytesIO(audio_data)
-            raw_speech, _ = librosa.load(audio_file, sr=16000)
-            start_time = time.perf_counter()
-            result = PIPE.generate(
-                raw_speech.tolist(),
-                task=request.task,
-                language=f"<|{request.language}|>",
-            )
-            inference_time = time.perf_counter() - start_time
-
-            return {"text": str(result), "generation_time_s": round(inference_time, 1)}
+            # Decoding and inference are blocking, keep them off the event loop
+            return await run_in_threadpool(transcribe, request)
         except Exception as e:
             logging.error(f"Error processing audio: {e}")
-            return JSONResponse(
+            return ORJSONResponse(
                 {
                     "status": False,
                     "message": "An error occurred while processing the audio",
@@ -325,14 +679,33 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
     return app
 
 
-if __name__ == "__main__":
+def app_factory():
+    """
+    Build the app inside each uvicorn worker process from the command line.
+    """
     args = parse_args()
     env = setup_env()
+    return create_app(args, env)
 
-    app = create_app(args, env)
 
-    uvicorn.run(
-        app,
-        host="127.0.0.1",
-        port=args.port,
-    )
+if __name__ == "__main__":
+    args = parse_args()
+    env = setup_env()
+
+    # Each worker loads its own pipeline and reports status, so more than one
+    # is opt-in
+    workers = max(1, args.workers)
+    server_options = {
+        "host": "127.0.0.1",
+        "port": args.port,
+        "loop": "asyncio" if platform.system() == "Windows" else "uvloop",
+        "http": "httptools",
+    }
+
+    if workers > 1:
+        # Download and export once here, so the workers only load the model
+        prepare_model(args, env)
+        uvicorn.run("main:app_factory", factory=True, workers=workers, **server_options)
+    else:
+        app = create_app(args, env)
+        uvicorn.run(app, **server_options)
@@ -3,12 +3,15 @@
 
 import os
 import re
+import asyncio
 import sys
-import cv2
 import time
 import math
 import socket
 import signal
+import selectors
+import functools
+import shutil
 import logging
 import uvicorn
 import zipfile
@@ -16,7 +19,6 @@ import requests
 import argparse
 import threading
 import urllib.parse
-import numpy as np
 import subprocess as sp
 
 from pathlib import Path
@@ -31,34 +33,56 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s",
 )
 
-# Set environment variables to enable dlstreamer
-os.environ["LIBVA_DRIVER_NAME"] = "iHD"
-os.environ["GST_PLUGIN_PATH"] = (
-    "/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/gstreamer/lib/gstreamer-1.0:/opt/intel/dlstreamer/streamer/lib/"
-)
-os.environ["LD_LIBRARY_PATH"] = (
-    "/opt/intel/dlstreamer/gstreamer/lib:/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/lib/gstreamer-1.0:/sr/lib:/opt/intel/dlstreamer/lib:/usr/local/lib/gstreamer-1.0:/usr/local/lib:/opt/opencv:/opt/rdkafka"
-)
-os.environ["LIBVA_DRIVERS_PATH"] = "/usr/lib/x86_64-linux-gnu/dri"
-os.environ["GST_VA_ALL_DRIVERS"] = "1"
-os.environ["PATH"] = (
-    f"/opt/intel/dlstreamer/gstreamer/bin:/opt/intel/dlstreamer/bin:{os.environ['PATH']}"
-)
-os.environ["GST_PLUGIN_FEATURE_RANK"] = (
-    os.environ.get("GST_PLUGIN_FEATURE_RANK", "") + ",ximagesink:MAX"
-)
-os.environ["GI_TYPELIB_PATH"] = (
-    "/opt/intel/dlstreamer/gstreamer/lib/girepository-1.0:/usr/lib/x86_64-linux-gnu/girepository-1.0"
-)
-
-env = os.environ.copy()
-venv_path = os.path.dirname(sys.executable)
-env["PATH"] = f"{venv_path}:{env['PATH']}"
 
 VIDEO_DIR = Path("../assets/media")
 MODEL_DIR = Path("./models")
 CUSTOM_MODELS_DIR = Path("../custom_models/object-detection-(DLStreamer)")
 RTSP_SERVER_URL = "rtsp://localhost:8554"
+# CPUs of each core type on Intel hybrid processors, absent on other systems
+P_CORES_PATH = Path("/sys/devices/cpu_core/cpus")
+E_CORES_PATH = Path("/sys/devices/cpu_atom/cpus")
+STATUS_URL = "http://127.0.0.1:8080/api/workloads"
+# Reused for every status update so the TCP connection to the backend is kept alive
+STATUS_SESSION = requests.Session()
+STATUS_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+)
+FPS_PATTERN = re.compile(
+    r"FpsCounter\(.*\): total=(\d+\.\d+) fps, number-streams=(\d+), per-stream=(\d+\.\d+) fps(?: \((.*?)\))?"
+)
+
+
+def setup_env():
+    """
+    Set the environment variables that enable DLStreamer for this process and
+    the gst-launch-1.0 subprocesses it spawns.
+    """
+    os.environ["LIBVA_DRIVER_NAME"] = "iHD"
+    os.environ["GST_PLUGIN_PATH"] = (
+        "/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/gstreamer/lib/gstreamer-1.0:/opt/intel/dlstreamer/streamer/lib/"
+    )
+    os.environ["LD_LIBRARY_PATH"] = (
+        "/opt/intel/dlstreamer/gstreamer/lib:/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/lib/gstreamer-1.0:/usr/local/lib/gstreamer-1.0:/usr/local/lib:/opt/opencv:/opt/rdkafka"
+    )
+    os.environ["LIBVA_DRIVERS_PATH"] = "/usr/lib/x86_64-linux-gnu/dri"
+    os.environ["GST_VA_ALL_DRIVERS"] = "1"
+    os.environ["PATH"] = (
+        f"/opt/intel/dlstreamer/gstreamer/bin:/opt/intel/dlstreamer/bin:{os.environ['PATH']}"
+    )
+    os.environ["GST_PLUGIN_FEATURE_RANK"] = (
+        os.environ.get("GST_PLUGIN_FEATURE_RANK", "") + ",ximagesink:MAX"
+    )
+    os.environ["GI_TYPELIB_PATH"] = (
+        "/opt/intel/dlstreamer/gstreamer/lib/girepository-1.0:/usr/lib/x86_64-linux-gnu/girepository-1.0"
+    )
+    venv_path = os.path.dirname(sys.executable)
+    os.environ["PATH"] = f"{venv_path}:{os.environ['PATH']}"
+    # A registry per venv matches this worker's plugin paths, so gst-launch-1.0
+    # does not rescan plugins on each start because of a stale shared cache
+    if sys.prefix != sys.base_prefix:
+        os.environ.setdefault(
+            "GST_REGISTRY", os.path.join(sys.prefix, "gst-registry.bin")
+        )
 
 
 def update_payload_status(workload_id: int, status):
@@ -70,34 +94,13 @@ def update_payload_status(workload_id: int, status):
         logging.error(f"Invalid workload ID: {workload_id}. Refusing to update status.")
         return
 
-    # Hardcode scheme & authority (safe allow-list)
-    allowed_scheme = "http"
-    allowed_netloc = "127.0.0.1:8080"
-
-    # Build the path carefully. Reject characters such as '../'
-    # in a real system, you might strictly allow digits only
-    path = f"/api/workloads/{workload_id}"
+    # Scheme and authority are fixed and is_valid_id only admits non-negative
+    # ints, so the path can only contain digits
+    url = f"{STATUS_URL}/{workload_id}"
 
-    # Use urllib.parse to verify
-    composed_url = f"{allowed_scheme}://{allowed_netloc}{path}"
-    parsed_url = urllib.parse.urlparse(composed_url)
-
-    # Enforce scheme & authority are what we expect
-    if parsed_url.scheme != allowed_scheme or parsed_url.netloc != allowed_netloc:
-        logging.error(f"URL scheme or authority not allowed: {parsed_url.geturl()}")
-        return
-
-    # Basic check for path traversal attempts (../, //, whitespace, etc.)
-    if ".." in path or "//" in path or " " in path:
-        logging.error(f"Invalid characters in URL path: {path}")
-        return
-
-    # Now safe to use
-    url = parsed_url.geturl()
-
-    data = {"status": status, "port": args.port}
+    data = {"status": status, "port": app.state.args.port}
     try:
-        response = requests.patch(url, json=data)
+        response = STATUS_SESSION.patch(url, json=data, timeout=2)
         response.raise_for_status()
         logging.info(f"Successfully updated status to {status} for {workload_id}.")
     except requests.exceptions.RequestException as e:
@@ -114,6 +117,14 @@ async def lifespan(app: FastAPI):
         "fps_streams": None,
         "timestamp": None,
     }
+    # Only the latest FPS report is kept, older ones are dropped on publish
+    app.state.metrics_queue = asyncio.Queue(maxsize=1)
+    app.state.loop = asyncio.get_running_loop()
+    app.state.cpu_affinity = resolve_cpu_affinity(app.state.args.cpu_affinity)
+    if app.state.cpu_affinity:
+        # Inherited by the pipeline thread and the gst-launch-1.0 process
+        os.sched_setaffinity(0, app.state.cpu_affinity)
+        logging.info(f"Pinned worker to CPUs: {sorted(app.state.cpu_affinity)}")
     thread = threading.Thread(target=main, daemon=True)
     thread.start()
     yield
@@ -160,7 +171,8 @@ def parse_arguments():
         "--model_precision",
         type=str,
         default="FP16",
-        help="Model precision (default: FP16)",
+        choices=["FP32", "FP16", "INT8"],
+        help="Model precision (default: FP16). INT8 is only used for CPU inference",
     )
     parser.add_argument(
         "--device",
@@ -177,8 +189,32 @@ def parse_arguments():
     parser.add_argument(
         "--batch_size",
         type=int,
-        default=1,
-        help="Batch size for inference (default: 1)",
+        default=None,
+        help="Batch size for inference (default: 1, set it to enable batching)",
+    )
+    parser.add_argument(
+        "--annotate",
+        action=argparse.BooleanOptionalAction,
+        default=True,
+        help="Draw detections on the MJPEG output with gvawatermark (default: enabled)",
+    )
+    parser.add_argument(
+        "--output_mode",
+        type=str,
+        default="mjpeg",
+        choices=["mjpeg", "metrics"],
+        help="mjpeg serves the annotated stream on /result, metrics only reports FPS and skips encoding (default: mjpeg)",
+    )
+    parser.add_argument(
+        "--via_rtsp",
+        action="store_true",
+        help="Relay video files through the RTSP server with ffmpeg instead of reading them directly",
+    )
+    parser.add_argument(
+        "--cpu_affinity",
+        type=str,
+        default=None,
+        help="CPUs to pin the worker and pipeline to, e.g. 0-7,16. Use 'auto' for the P-cores of a hybrid CPU (default: no pinning)",
     )
     parser.add_argument(
         "--tcp_port",
@@ -216,7 +252,81 @@ def parse_arguments():
     return parser.parse_args()
 
 
-args = parse_arguments()
+def parse_cpu_list(cpu_list):
+    """
+    Parse a Linux CPU list such as "0-3,8,10-11" into a set of CPU ids.
+    """
+    cpus = set()
+    for part in cpu_list.strip().split(","):
+        if not part:
+            continue
+        first, _, last = part.partition("-")
+        cpus.update(range(int(first), int(last or first) + 1))
+    return cpus
+
+
+def read_cpu_list(path):
+    """
+    Read a CPU list from sysfs, returning an empty set if it is not available.
+    """
+    try:
+        return parse_cpu_list(path.read_text())
+    except (OSError, ValueError):
+        return set()
+
+
+def resolve_cpu_affinity(cpu_affinity):
+    """
+    Resolve the --cpu_affinity argument into the set of CPUs to pin to.
+    Returns None when the worker should not be pinned.
+    """
+    if not cpu_affinity or not hasattr(os, "sched_setaffinity"):
+        return None
+    if cpu_affinity == "auto":
+        p_cores = read_cpu_list(P_CORES_PATH)
+        if not p_cores:
+            logging.info("No hybrid CPU topology found, CPU affinity not applied")
+            return None
+        return p_cores
+    try:
+        return parse_cpu_list(cpu_affinity) & os.sched_getaffinity(0) or None
+    except ValueError:
+        logging.warning(f"Invalid CPU list: {cpu_affinity}, CPU affinity not applied")
+        return None
+
+
+@functools.lru_cache(maxsize=None)
+def gst_element_available(element):
+    """
+    Check whether a GStreamer element is installed.
+    """
+    try:
+        result = sp.run(
+            ["gst-inspect-1.0", "--exists", element],
+            stdout=sp.DEVNULL,
+            stderr=sp.DEVNULL,
+            timeout=10,
+        )
+        return result.returncode == 0
+    except (OSError, sp.TimeoutExpired):
+        return False
+
+
+def auto_nireq(device, batch_size=1):
+    """
+    Pick the number of inference requests for a device string such as CPU,
+    GPU.0 or MULTI:CPU,GPU.
+    """
+    _, _, device_list = device.rpartition(":")
+    nireq = 0
+    for target in device_list.split(","):
+        if target.startswith("CPU"):
+            # About one request per physical core the worker may run on
+            nireq += max(2, len(os.sched_getaffinity(0)) // 2)
+        else:
+            # Larger batches already fill the GPU/NPU execution units
+            nireq += max(2, 8 // max(1, batch_size))
+    return nireq
 
 
 def build_compositor_props(num_streams, final_width, final_height):
@@ -257,8 +367,12 @@ def build_pipeline(
     model_label_path,
     device,
     decode_device,
-    batch_size=1,
+    batch_size=None,
     number_of_streams=1,
+    width_limit=640,
+    height_limit=480,
+    annotate=True,
+    output_mode="mjpeg",
 ):
     """
     Build the DLStreamer pipeline for MJPEG streaming.
@@ -266,7 +380,7 @@ def build_pipeline(
 
     # Check if input is a videofile
     if input.endswith((".mp4", ".avi", ".mov")):
-        source_command = [" multifilesrc", f"location={input}", "loop=true"]
+        source_command = ["multifilesrc", f"location={input}", "loop=true"]
     elif input.startswith("rtsp://"):
         source_command = ["rtspsrc", f"location={input}", "protocols=tcp"]
     else:
@@ -289,7 +403,7 @@ def build_pipeline(
 
     # Configure decode element
     if "CPU" in decode_device:
-        if input.startswith("/dev/video"):
+        if not input.startswith("rtsp://"):
             decode_element = ["decodebin3", "!", "videoconvert", "!", "video/x-raw"]
         else:
             decode_element = [
@@ -302,15 +416,50 @@ def build_pipeline(
                 "video/x-raw",
             ]
     elif "GPU" in decode_device:
-        decode_element = [
-            "rtph264depay",
-            "!",
-            "avdec_h264",
-            "!",
-            "vapostproc",
-            "!",
-            "video/x-raw(memory:VAMemory)",
-        ]
+        va_decoder = next(
+            (
+                element
+                for element in ("vah264dec", "vah264lpdec")
+                if gst_element_available(element)
+            ),
+            None,
+        )
+        if (
+            input.startswith("/dev/video")
+            or input.endswith(".avi")
+            or (va_decoder is None and not input.startswith("rtsp://"))
+        ):
+            decode_element = [
+                "decodebin3",
+                "!",
+                "vapostproc",
+                "!",
+                "video/x-raw(memory:VAMemory)",
+            ]
+        elif va_decoder is None:
+            logging.warning("VA-API H.264 decoder not found, decoding on CPU")
+            decode_element = [
+                "rtph264depay",
+                "!",
+                "avdec_h264",
+                "!",
+                "vapostproc",
+                "!",
+                "video/x-raw(memory:VAMemory)",
+            ]
+        else:
+            # Hardware decode keeps frames in VA memory all the way to inference
+            demux_element = (
+                ["rtph264depay"] if input.startswith("rtsp://") else ["qtdemux"]
+            )
+            decode_element = demux_element + [
+                "!",
+                "h264parse",
+                "!",
+                va_decoder,
+                "!",
+                "video/x-raw(memory:VAMemory),format=NV12",
+            ]
     else:
         logging.error("Incorrect parameter DECODE_DEVICE. Supported values: CPU, GPU")
         sys.exit(1)
@@ -325,29 +474,67 @@ def build_pipeline(
     if model_label_path is not None:
         inference_command.append(f"labels-file={model_label_path}")
 
-    if "GPU" in decode_device and "GPU" in device:
-        inference_command.append(f"batch-size={batch_size}")
+    # gst-launch-1.0 re-tokenizes its arguments, keep the id to word characters
+    model_instance_name = re.sub(r"\W", "_", Path(model_full_path).stem)
+    # Streams share one compiled model so their frames can be batched together
+    inference_command.append(f"model-instance-id=shared_{model_instance_name}")
+    if batch_size is not None:
+        # An explicit batch size keeps enough requests in flight to fill the
+        # next batch while the current one runs
+        inference_command += [
+            f"batch-size={batch_size}",
+            f"nireq={auto_nireq(device, batch_size)}",
+            "ie-config=PERFORMANCE_HINT=THROUGHPUT",
+        ]
+    elif "GPU" in decode_device:
         inference_command.append("nireq=4")
-        inference_command.append("pre-process-backend=va-surface-sharing")
-    elif "GPU" in decode_device and "CPU" in device:
-        inference_command.append("pre-process-backend=va")
 
-    comp_props_str = build_compositor_props(
-        args.number_of_streams, args.width_limit, args.height_limit
-    )
-    comp_props = comp_props_str.split()
-    logging.info(f"Compositor properties: {comp_props_str}")
-
-    # Build the compositor pipeline
-    pipeline = (
-        ["gst-launch-1.0", "compositor", "name=comp"]
-        + comp_props
-        + ["!"]
-        + ["jpegenc", "!", "multipartmux", "boundary=frame"]
-        + ["!"]
-        + ["tcpserversink", f"host=127.0.0.1", f"port={tcp_port}"]
-    )
-    logging.info(f"Partial Pipeline={pipeline}")
+    if "GPU" in decode_device:
+        if "GPU" in device:
+            inference_command.append("pre-process-backend=va-surface-sharing")
+        else:
+            inference_command.append("pre-process-backend=va")
+
+    # Convert watermarked frames for jpegenc on the GPU scaler when they are
+    # already in VA memory
+    if "GPU" in decode_device:
+        convert_element = ["vapostproc", "!", "video/x-raw,format=I420"]
+    else:
+        convert_element = ["videoconvert"]
+
+    # Elements after inference, frames are only drawn on and encoded when the
+    # MJPEG output is used
+    output_elements = ["!", "queue", "!", "gvafpscounter", "!"]
+    if output_mode == "metrics":
+        output_elements += ["fakesink", "sync=true"]
+    else:
+        if annotate:
+            output_elements += ["gvawatermark", "!"]
+        output_elements += [*convert_element, "!"]
+
+    if output_mode == "metrics":
+        pipeline = ["gst-launch-1.0"]
+    else:
+        comp_props_str = build_compositor_props(
+            number_of_streams, width_limit, height_limit
+        )
+        comp_props = comp_props_str.split()
+        logging.info(f"Compositor properties: {comp_props_str}")
+
+        # Encode JPEG on the GPU when VA-API encoding is available
+        jpeg_encoder = "vajpegenc" if gst_element_available("vajpegenc") else "jpegenc"
+        logging.info(f"JPEG encoder: {jpeg_encoder}")
+
+        # Build the compositor pipeline
+        pipeline = (
+            ["gst-launch-1.0", "compositor", "name=comp"]
+            + comp_props
+            + ["!"]
+            + [jpeg_encoder, "quality=85", "!", "multipartmux", "boundary=frame"]
+            + ["!"]
+            + ["tcpserversink", f"host=127.0.0.1", f"port={tcp_port}"]
+        )
+        logging.info(f"Partial Pipeline={pipeline}")
 
     # Compose the full pipeline
     if input.startswith("/dev/video") and number_of_streams > 1:
@@ -364,21 +551,12 @@ def build_pipeline(
                     "!",
                 ]
                 + decode_element
-                + [
-                    "!",
-                    *inference_command,
-                    "!",
-                    "queue",
-                    "!",
-                    "gvafpscounter",
-                    "!",
-                    "gvawatermark",
-                    "!",
-                    "videoconvert",
-                    "!",
-                    f"comp.sink_{i}",
-                ]
+                + ["!"]
+                + inference_command
+                + output_elements
             )
+            if output_mode != "metrics":
+                pipeline.append(f"comp.sink_{i}")
     else:
         for i in range(number_of_streams):
             pipeline += (
@@ -387,19 +565,10 @@ def build_pipeline(
                 + decode_element
                 + ["!"]
                 + inference_command
-                + [
-                    "!",
-                    "queue",
-                    "!",
-                    "gvafpscounter",
-                    "!",
-                    "gvawatermark",
-                    "!",
-                    "videoconvert",
-                    "!",
-                    f"comp.sink_{i}",
-                ]
+                + output_elements
             )
+            if output_mode != "metrics":
+                pipeline.append(f"comp.sink_{i}")
     # Log the pipeline
     logging.info(f"Full pipeline={' '.join(pipeline)}\n")
     return pipeline
@@ -413,45 +582,88 @@ def stop_signal_handler(sig, frame):
     exit(0)
 
 
-signal.signal(signal.SIGINT, stop_signal_handler)
-
-
 def run_pipeline(pipeline):
     """
     Run the GStreamer pipeline and process its output in real-time.
-    Handles EOS for looping and updates pipeline metrics.
+    Logs how the pipeline exited and updates pipeline metrics.
     """
     logging.info("Starting GStreamer pipeline...")
+    # gst-launch-1.0 block-buffers stdout into a pipe, force line buffering so
+    # FPS metrics arrive as soon as they are printed
+    if shutil.which("stdbuf"):
+        pipeline = ["stdbuf", "-oL"] + pipeline
+    process = None
     try:
-        process = sp.Popen(pipeline, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
-        # Monitor the pipeline's stdout
-        for line in process.stdout:
-            logging.info(line.strip())
-            # Process each line of output using filter_result
-            metrics = filter_result(line.strip())
-            if metrics:
-                app.state.pipeline_metrics.update(metrics)
-
-        # Capture any errors from stderr
-        for error_line in process.stderr:
-            logging.error(error_line.strip())
+        process = sp.Popen(pipeline, stdout=sp.PIPE, stderr=sp.PIPE, bufsize=0)
+        # Drain stdout and stderr together, a full stderr pipe would otherwise
+        # stall gst-launch-1.0 while only stdout is being read
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ, logging.info)
+            selector.register(process.stderr, selectors.EVENT_READ, logging.error)
+            pending = {process.stdout: b"", process.stderr: b""}
+            while selector.get_map():
+                for key, _ in selector.select():
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        process_pipeline_line(pending[key.fileobj], key.data)
+                        continue
+                    buffered = pending[key.fileobj] + chunk
+                    *lines, pending[key.fileobj] = buffered.split(b"\n")
+                    for line in lines:
+                        process_pipeline_line(line, key.data)
+        process.wait()
 
         # Check if the process exited due to EOS
-        if process.returncode == 0 or process.returncode is None:
-            logging.info("Pipeline reached EOS. Restarting...")
-            process.communicate()
+        if process.returncode == 0:
+            logging.info("Pipeline reached EOS.")
         else:
             logging.error(f"Pipeline exited with error code: {process.returncode}")
 
     except Exception as e:
         logging.error(f"Unexpected error: {e}")
-        if process and process.poll() is None:
-            process.terminate()
-            process.wait()
     finally:
-        if process and process.poll() is None:
-            process.terminate()
-            process.wait()
+        stop_pipeline_process(process)
+
+
+def process_pipeline_line(line: bytes, log):
+    """
+    Log one line of pipeline output and update the metrics from FPS lines.
+    """
+    text = line.decode(errors="replace").strip()
+    if not text:
+        return
+    log(text)
+    if b"FpsCounter(" in line:
+        metrics = filter_result(text)
+        if metrics:
+            # Hand the snapshot to the event loop, /api/metrics reads it there
+            app.state.loop.call_soon_threadsafe(publish_metrics, metrics)
+
+
+def publish_metrics(metrics):
+    """
+    Replace the pending metrics snapshot. Runs on the event loop thread.
+    """
+    metrics_queue = app.state.metrics_queue
+    if metrics_queue.full():
+        metrics_queue.get_nowait()
+    metrics_queue.put_nowait(metrics)
+
+
+def stop_pipeline_process(process, timeout=5):
+    """
+    Stop gst-launch-1.0 with SIGINT so it shuts the pipeline down cleanly,
+    terminating it if it does not exit in time.
+    """
+    if process is None or process.poll() is not None:
+        return
+    process.send_signal(signal.SIGINT)
+    try:
+        process.wait(timeout=timeout)
+    except sp.TimeoutExpired:
+        process.terminate()
+        process.wait()
 
 
 def filter_result(output):
@@ -464,10 +676,10 @@ def filter_result(output):
     Returns:
         dict: A dictionary containing the total FPS, the number of streams, the average FPS per stream, a mapping of individual stream FPS values and timestamp.
     """
-    fps_pattern = re.compile(
-        r"FpsCounter\(.*\): total=(\d+\.\d+) fps, number-streams=(\d+), per-stream=(\d+\.\d+) fps(?: \((.*?)\))?"
-    )
-    match = fps_pattern.search(output)
+    # Most pipeline output is not FPS related, skip it before running the regex
+    if "FpsCounter(" not in output:
+        return None
+    match = FPS_PATTERN.search(output)
     if match:
         total_fps_str = match.group(1)
         number_streams_str = match.group(2)
@@ -499,36 +711,72 @@ def filter_result(output):
     return None
 
 
-def is_rtsp_stream_running(rtsp_url, retries=5, delay=1):
+def is_rtsp_stream_running(rtsp_url, timeout=5.0, delay=0.05, max_delay=0.4):
     """
-    Check if the RTSP stream is running by attempting to open it with OpenCV.
-    Retry every second for a maximum number of retries.
+    Check if an RTSP stream is being published with a lightweight RTSP DESCRIBE
+    request, no decoder is opened. Retry with exponential backoff from delay up to
+    max_delay seconds until timeout seconds have elapsed.
     """
-    for attempt in range(retries):
+    parsed_url = urllib.parse.urlparse(rtsp_url)
+    address = (parsed_url.hostname, parsed_url.port or 554)
+    # DESCRIBE rather than OPTIONS, mediamtx answers OPTIONS even before a
+    # publisher is connected but only describes streams that exist
+    request = (
+        f"DESCRIBE {rtsp_url} RTSP/1.0\r\nCSeq: 1\r\nAccept: application/sdp\r\n\r\n"
+    ).encode()
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            cap = cv2.VideoCapture(rtsp_url)
-            if cap.isOpened():
+            with socket.create_connection(address, timeout=0.5) as probe_socket:
+                probe_socket.sendall(request)
+                response = probe_socket.recv(1024)
+            if response.startswith(b"RTSP/1.0 200"):
                 logging.info(f"RTSP stream is running at: {rtsp_url}")
-                cap.release()
                 return True
-            else:
-                logging.warning(
-                    f"RTSP stream is not running at: {rtsp_url}. Retrying... ({attempt + 1}/{retries})"
-                )
-        except Exception as e:
-            logging.error(
-                f"Error checking RTSP stream: {e}. Retrying... ({attempt + 1}/{retries})"
-            )
-        time.sleep(delay)
+        except OSError as e:
+            logging.debug(f"Error checking RTSP stream: {e} (attempt {attempt})")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+    logging.warning(
+        f"RTSP stream is not running at: {rtsp_url} after {attempt} attempts"
+    )
     return False
 
 
 def is_valid_video_file(filepath):
     """
-    Check if the given file is a valid video file using OpenCV.
+    Check if the given file is a valid video file using ffprobe, falling back to OpenCV
+    when ffprobe is not installed.
     """
     if not os.path.isfile(filepath):
         return False
+    if shutil.which("ffprobe"):
+        try:
+            result = sp.run(
+                [
+                    "ffprobe",
+                    "-v",
+                    "error",
+                    "-select_streams",
+                    "v",
+                    "-show_streams",
+                    filepath,
+                ],
+                capture_output=True,
+                timeout=5,
+            )
+        except sp.TimeoutExpired:
+            return False
+        return result.returncode == 0 and b"codec_type=video" in result.stdout
+
+    # Imported lazily, OpenCV is only needed for this check
+    import cv2
+
     cap = cv2.VideoCapture(filepath)
     valid = cap.isOpened()
     cap.release()
@@ -539,15 +787,14 @@ def is_valid_id(id):
     """
     Validate the workload ID to prevent URL manipulation and ensure it is a positive integer.
     """
-    if isinstance(id, int) and id >= 0:
-        return True
-    return False
+    return type(id) is int and id >= 0
 
 
 def main():
     """
     Main function to start the GStreamer pipeline.
     """
+    args = app.state.args
     logging.info(
         f"View stream at url: http://localhost:{args.port}/result/{args.tcp_port}"
     )
@@ -581,42 +828,54 @@ def main():
             )
             update_payload_status(args.id, status="failed")
             exit(1)
-        filename = os.path.splitext(os.path.basename(args.input))[0]
-        rtsp_url = f"{RTSP_SERVER_URL}/{filename}-{args.id}"
-        logging.info(f"Hosting RTSP stream at: {rtsp_url}")
-        ffmpeg_command = [
-            "ffmpeg",
-            "-re",
-            "-stream_loop",
-            "-1",
-            "-i",
-            args.input,
-            "-c",
-            "copy",
-            "-f",
-            "rtsp",
-            "-rtsp_transport",
-            "tcp",
-            rtsp_url,
-        ]
-        args.input = rtsp_url
+        # multifilesrc loops the file inside the pipeline, only relay it through
+        # the RTSP server when explicitly requested
+        if args.via_rtsp:
+            filename = os.path.splitext(os.path.basename(args.input))[0]
+            rtsp_url = f"{RTSP_SERVER_URL}/{filename}-{args.id}"
+            logging.info(f"Hosting RTSP stream at: {rtsp_url}")
+            ffmpeg_command = [
+                "ffmpeg",
+                "-re",
+                "-stream_loop",
+                "-1",
+                "-i",
+                args.input,
+                "-c",
+                "copy",
+                "-f",
+                "rtsp",
+                "-rtsp_transport",
+                "tcp",
+                rtsp_url,
+            ]
+            args.input = rtsp_url
 
-        try:
-            # ffmpeg_process = sp.Popen(ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
-            ffmpeg_process = sp.Popen(
-                ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL
-            )
-            logging.info(f"Started RTSP streaming with PID: {ffmpeg_process.pid}")
-        except sp.CalledProcessError as e:
-            logging.error(f"Failed to host RTSP stream: {e}")
+            # Keep the stream relay off the cores reserved for the pipeline
+            relay_cpus = read_cpu_list(E_CORES_PATH) - (app.state.cpu_affinity or set())
+            if app.state.cpu_affinity and relay_cpus and shutil.which("taskset"):
+                ffmpeg_command = [
+                    "taskset",
+                    "-c",
+                    ",".join(map(str, sorted(relay_cpus))),
+                ] + ffmpeg_command
 
-    # Check if the RTSP stream is running
-    if not is_rtsp_stream_running(args.input, retries=5, delay=1):
-        logging.error("RTSP stream is not running after multiple attempts. Exiting...")
-        update_payload_status(args.id, status="failed")
-        exit(1)
-    else:
-        time.sleep(5)  # Give 5 seconds for mediamtx to start digesting the stream
+            try:
+                # ffmpeg_process = sp.Popen(ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL)
+                ffmpeg_process = sp.Popen(
+                    ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL
+                )
+                logging.info(f"Started RTSP streaming with PID: {ffmpeg_process.pid}")
+            except sp.CalledProcessError as e:
+                logging.error(f"Failed to host RTSP stream: {e}")
+
+            # Check if the RTSP stream is running
+            if not is_rtsp_stream_running(args.input):
+                logging.error(
+                    "RTSP stream is not running after multiple attempts. Exiting..."
+                )
+                update_payload_status(args.id, status="failed")
+                exit(1)
 
     model_label_path = None
 
@@ -652,19 +911,36 @@ def main():
         custom_model_path = CUSTOM_MODELS_DIR / args.model
         if not custom_model_path.exists():
             # predefined model
+            model_precision = args.model_precision
+            if model_precision == "INT8" and "CPU" not in args.device:
+                # INT8 can lower throughput on GPU/NPU, keep FP16 there
+                logging.info("INT8 is only used for CPU inference, loading FP16")
+                model_precision = "FP16"
+
             model_status = export_yolo_model(
-                model_name=args.model, model_parent_dir=args.model_parent_dir
+                model_name=args.model,
+                model_parent_dir=args.model_parent_dir,
+                int8=model_precision == "INT8",
+                calibration_video=VIDEO_DIR / "people-detection.mp4",
             )
 
             if not model_status:
                 update_payload_status(args.id, status="failed")
                 exit(1)
 
+            int8_model_path = (
+                Path(args.model_parent_dir) / f"{args.model}-INT8" / f"{args.model}.xml"
+            )
+            if model_precision == "INT8" and not int8_model_path.exists():
+                logging.warning("INT8 model not available, loading FP16")
+                model_precision = "FP16"
+
             model_full_path = (
                 Path(args.model_parent_dir)
-                / f"{args.model}-{args.model_precision}"
+                / f"{args.model}-{model_precision}"
                 / f"{args.model}.xml"
             )
+            logging.info(f"Loading {model_precision} model: {model_full_path}")
         else:
             custom_model_files = list(custom_model_path.glob("*.xml"))
             if not custom_model_files:
@@ -685,7 +961,12 @@ def main():
         model_label_path=model_label_path,
         device=args.device,
         decode_device=args.decode_device,
+        batch_size=args.batch_size,
         number_of_streams=args.number_of_streams,
+        width_limit=args.width_limit,
+        height_limit=args.height_limit,
+        annotate=args.annotate,
+        output_mode=args.output_mode,
     )
 
     # Start the pipeline
@@ -700,54 +981,52 @@ def main():
         logging.error(f"An error occurred while running the pipeline: {e}")
 
 
-def mjpeg_stream(host: str = "127.0.0.1", port: int = 5000):
+async def mjpeg_stream(host: str = "127.0.0.1", port: int = 5000):
     """
-    Connect to the GStreamer TCP server and yield MJPEG frames.
+    Connect to the GStreamer TCP server and relay its multipart MJPEG stream.
     """
+    boundary = b"--frame\r\n"
     # Connect to the TCP server
-    with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-        client_socket.connect((host, port))
-        buffer = b""
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        client_socket = writer.get_extra_info("socket")
+        client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
 
+        # tcpserversink can start a new client in the middle of a part, drop
+        # everything before the first boundary
+        buffer = b""
         while True:
-            # Read data from the TCP server
-            data = client_socket.recv(4096)
+            data = await reader.read(65536)
             if not data:
-                break
-
+                return
             buffer += data
-            while b"\r\n\r\n" in buffer:
-                frame, _, buffer = buffer.partition(b"\r\n\r\n")
-
-                try:
-                    # Convert raw frame data to a NumPy array and decode the frame
-                    np_frame = np.frombuffer(frame, dtype=np.uint8)
-                    image = cv2.imdecode(np_frame, cv2.IMREAD_COLOR)
-                    if image is None:
-                        continue
-
-                    # Encode the image as JPEG
-                    _, jpeg_frame = cv2.imencode(".jpg", image)
+            start = buffer.find(boundary)
+            if start != -1:
+                yield buffer[start:]
+                break
+            # Keep the tail in case a boundary is split across reads
+            buffer = buffer[-(len(boundary) - 1) :]
 
-                    # Yield the encoded JPEG frame
-                    yield (
-                        b"--frame\r\n"
-                        b"Content-Type: image/jpeg\r\n\r\n"
-                        + jpeg_frame.tobytes()
-                        + b"\r\n"
-                    )
-                except Exception as e:
-                    logging.info(f"Error processing frame: {e}")
+        # multipartmux already emits a multipart/x-mixed-replace body with the
+        # same boundary, forward the bytes without parsing them
+        while True:
+            data = await reader.read(65536)
+            if not data:
+                break
+            yield data
+    finally:
+        writer.close()
 
 
 @app.get("/result")
-def get_mjpeg_stream():
+async def get_mjpeg_stream():
     """
     Serve the MJPEG stream as an HTTP response.
     """
     try:
         return StreamingResponse(
-            mjpeg_stream(port=args.tcp_port),
+            mjpeg_stream(port=app.state.args.tcp_port),
             media_type="multipart/x-mixed-replace; boundary=frame",
         )
     except Exception as e:
@@ -760,11 +1039,13 @@ def get_mjpeg_stream():
 
 
 @app.get("/api/metrics")
-def get_pipeline_metrics():
+async def get_pipeline_metrics():
     """
     Return the current pipeline metrics.
     """
     try:
+        if not app.state.metrics_queue.empty():
+            app.state.pipeline_metrics = app.state.metrics_queue.get_nowait()
         result = {
             "data": app.state.pipeline_metrics,
             "status": "success",
@@ -778,4 +1059,10 @@ def get_pipeline_metrics():
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=args.port)
+    args = parse_arguments()
+    setup_env()
+    signal.signal(signal.SIGINT, stop_signal_handler)
+    app.state.args = args
+    # Serve this app object instead of letting uvicorn import the module
+    # again by name
+    uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port)).run()
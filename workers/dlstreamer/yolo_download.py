@@ -62,6 +62,10 @@ YOLO_MODELS = {
 # Define the MODELS_DIR environment variable
 MODELS_DIR = os.getenv("MODELS_DIR", "./models")
 
+# Sample video and number of frames used to calibrate INT8 quantization
+CALIBRATION_VIDEO = Path("../assets/media/people-detection.mp4")
+CALIBRATION_FRAMES = 300
+
 
 def is_path_safe(base_dir: Path, path: Path) -> bool:
     """Make sure resolved path is within in the intended base directory."""
@@ -142,9 +146,87 @@ def safe_rmtree(path, max_retries=5, delay=0.5):
     return False
 
 
-def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
+def quantize_yolo_model(
+    model_path_fp32: Path, model_path_int8: Path, calibration_video: Path
+) -> bool:
+    """
+    Produce an INT8 model from the FP32 model with NNCF post-training quantization,
+    calibrated on frames from a sample video.
+    """
+    if model_path_int8.exists():
+        logging.info(f"INT8 model already exists: {model_path_int8}")
+        return True
+
+    import cv2
+    import nncf
+    import numpy as np
+
+    core = ov.Core()
+    ov_model = core.read_model(model=str(model_path_fp32))
+    _, _, input_height, input_width = ov_model.input(0).get_shape()
+
+    # Collect calibration frames in the layout the exported model expects
+    calibration_frames = []
+    cap = cv2.VideoCapture(str(calibration_video))
+    while len(calibration_frames) < CALIBRATION_FRAMES:
+        ret, frame = cap.read()
+        if not ret:
+            break
+        frame = cv2.resize(frame, (input_width, input_height))
+        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+        frame = frame.transpose(2, 0, 1)[np.newaxis].astype(np.float32) / 255.0
+        calibration_frames.append(frame)
+    cap.release()
+
+    if not calibration_frames:
+        logging.warning(f"No calibration frames could be read from {calibration_video}")
+        return False
+
+    logging.info(
+        f"Quantizing {model_path_fp32} to INT8 with {len(calibration_frames)} frames"
+    )
+    quantized_model = nncf.quantize(
+        ov_model,
+        nncf.Dataset(calibration_frames),
+        preset=nncf.QuantizationPreset.MIXED,
+        subset_size=len(calibration_frames),
+    )
+    model_path_int8.parent.mkdir(parents=True, exist_ok=True)
+    ov.save_model(quantized_model, str(model_path_int8), compress_to_fp16=False)
+
+    del ov_model, quantized_model, core
+    gc.collect()
+
+    logging.info(f"Model saved: {model_path_int8}")
+    return True
+
+
+def try_quantize_yolo_model(
+    model_path_fp32: Path, model_path_int8: Path, calibration_video: Path
+):
+    """
+    Best-effort INT8 quantization. Failures are logged and leave the FP32 and
+    FP16 models in place, so the caller can fall back to FP16.
+    """
+    try:
+        if quantize_yolo_model(model_path_fp32, model_path_int8, calibration_video):
+            return
+    except Exception as e:
+        logging.warning(f"INT8 quantization of {model_path_fp32} failed: {e}")
+        return
+    logging.warning(f"INT8 model was not produced for {model_path_fp32}")
+
+
+def export_yolo_model(
+    model_name,
+    model_parent_dir=MODELS_DIR,
+    int8=False,
+    calibration_video=CALIBRATION_VIDEO,
+):
     """
     Download and convert YOLO models to OpenVINO format.
+    FP32 and FP16 models are always produced, INT8 is attempted when int8 is set
+    and its failure does not fail the export.
     """
 
     # Validate the model name
@@ -162,9 +244,16 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
     model_dir_fp16 = base_dir / f"{model_name}-FP16"
     model_path_fp32 = model_dir_fp32 / f"{model_name}.xml"
     model_path_fp16 = model_dir_fp16 / f"{model_name}.xml"
+    model_path_int8 = base_dir / f"{model_name}-INT8" / f"{model_name}.xml"
 
     # Validate all paths are within the base directory
-    for p in [model_dir_fp32, model_dir_fp16, model_path_fp32, model_path_fp16]:
+    for p in [
+        model_dir_fp32,
+        model_dir_fp16,
+        model_path_fp32,
+        model_path_fp16,
+        model_path_int8,
+    ]:
         if not is_path_safe(base_dir, p):
             logging.error(f"Unsafe model path detected: {p}")
             sys.exit(1)
@@ -173,6 +262,10 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
     is_model_exist = model_files_exist_and_safe(model_path_fp32, model_path_fp16)
     if is_model_exist:
         logging.info(f"Model already exists: {model_path_fp32} and {model_path_fp16}")
+        if int8:
+            try_quantize_yolo_model(
+                model_path_fp32, model_path_int8, Path(calibration_video)
+            )
         return True
 
     logging.info(f"Downloading and converting: {model_name}")
@@ -226,6 +319,11 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
 
     logging.info(f"Model saved: {model_path_fp32} and {model_path_fp16}")
 
+    if int8:
+        try_quantize_yolo_model(
+            model_path_fp32, model_path_int8, Path(calibration_video)
+        )
+
     return True
 
 
@@ -3,12 +3,15 @@
 
 import os
 import re
+import asyncio
 import sys
 import cv2
 import time
 import math
 import socket
 import signal
+import functools
+import selectors
 import logging
 import uvicorn
 import zipfile
@@ -30,40 +33,58 @@ logging.basicConfig(
     level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Set environment variables to enable dlstreamer
-os.environ["LIBVA_DRIVER_NAME"] = "iHD"
-os.environ["GST_PLUGIN_PATH"] = (
-    "/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/gstreamer/lib/gstreamer-1.0:/opt/intel/dlstreamer/streamer/lib/"
-)
-os.environ["LD_LIBRARY_PATH"] = (
-    "/opt/intel/dlstreamer/gstreamer/lib:/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/lib/gstreamer-1.0:/sr/lib:/opt/intel/dlstreamer/lib:/usr/local/lib/gstreamer-1.0:/usr/local/lib:/opt/opencv:/opt/rdkafka"
-)
-os.environ["LIBVA_DRIVERS_PATH"] = "/usr/lib/x86_64-linux-gnu/dri"
-os.environ["GST_VA_ALL_DRIVERS"] = "1"
-os.environ["PATH"] = (
-    f"/opt/intel/dlstreamer/gstreamer/bin:/opt/intel/dlstreamer/bin:{os.environ['PATH']}"
-)
-os.environ["GST_PLUGIN_FEATURE_RANK"] = (
-    os.environ.get("GST_PLUGIN_FEATURE_RANK", "") + ",ximagesink:MAX"
-)
-os.environ["GI_TYPELIB_PATH"] = (
-    "/opt/intel/dlstreamer/gstreamer/lib/girepository-1.0:/usr/lib/x86_64-linux-gnu/girepository-1.0"
-)
-
-env = os.environ.copy()
-venv_path = os.path.dirname(sys.executable)
-venv_bin = str(Path(sys.executable).parent)
-env["PATH"] = f"{venv_path}:{env['PATH']}"
 
 VIDEO_DIR = Path("../assets/media")
 MODEL_DIR = Path("./models")
 CUSTOM_MODELS_DIR = Path("../custom_models/instance-segmentation-(DLStreamer)")
 RSTP_SERVER_URL = "rtsp://localhost:8554"
+# Reused for every status update so the TCP connection to the backend is kept alive
+STATUS_SESSION = requests.Session()
+STATUS_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+)
+FPS_PATTERN = re.compile(
+    r"FpsCounter\(.*?\): total=(\d+\.\d+) fps, number-streams=(\d+), per-stream=(\d+\.\d+) fps(?: \((.*?)\))?"
+)
+# Initial size of the MJPEG receive buffer, grown if a single frame is larger
+MJPEG_BUFFER_SIZE = 1 << 20
 
 pipeline_process = None
 ffmpeg_process = None
 
-app = FastAPI()
+
+def setup_env():
+    """
+    Set the environment variables that enable DLStreamer for this process and
+    the gst-launch-1.0 subprocesses it spawns.
+    """
+    os.environ["LIBVA_DRIVER_NAME"] = "iHD"
+    os.environ["GST_PLUGIN_PATH"] = (
+        "/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/gstreamer/lib/gstreamer-1.0:/opt/intel/dlstreamer/streamer/lib/"
+    )
+    os.environ["LD_LIBRARY_PATH"] = (
+        "/opt/intel/dlstreamer/gstreamer/lib:/opt/intel/dlstreamer/lib:/opt/intel/dlstreamer/lib/gstreamer-1.0:/usr/local/lib/gstreamer-1.0:/usr/local/lib:/opt/opencv:/opt/rdkafka"
+    )
+    os.environ["LIBVA_DRIVERS_PATH"] = "/usr/lib/x86_64-linux-gnu/dri"
+    os.environ["GST_VA_ALL_DRIVERS"] = "1"
+    os.environ["PATH"] = (
+        f"/opt/intel/dlstreamer/gstreamer/bin:/opt/intel/dlstreamer/bin:{os.environ['PATH']}"
+    )
+    os.environ["GST_PLUGIN_FEATURE_RANK"] = (
+        os.environ.get("GST_PLUGIN_FEATURE_RANK", "") + ",ximagesink:MAX"
+    )
+    os.environ["GI_TYPELIB_PATH"] = (
+        "/opt/intel/dlstreamer/gstreamer/lib/girepository-1.0:/usr/lib/x86_64-linux-gnu/girepository-1.0"
+    )
+    venv_path = os.path.dirname(sys.executable)
+    os.environ["PATH"] = f"{venv_path}:{os.environ['PATH']}"
+    # Keep the plugin registry with the worker environment, gst-launch-1.0 then
+    # reuses it on every start instead of rescanning against a shared registry
+    # built for different plugin paths
+    if sys.prefix != sys.base_prefix:
+        os.environ.setdefault(
+            "GST_REGISTRY", os.path.join(sys.prefix, "gst-registry.bin")
+        )
 
 
 def is_valid_id(workload_id):
@@ -104,9 +125,9 @@ def update_payload_status(workload_id: int, status):
 
     # now safe to use
     url = parsed_url.geturl()
-    data = {"status": status, "port": args.port}
+    data = {"status": status, "port": app.state.args.port}
     try:
-        response = requests.patch(url, json=data)
+        response = STATUS_SESSION.patch(url, json=data, timeout=2)
         response.raise_for_status()
         logging.info(f"Successfully updated to {status} for {workload_id}.")
     except requests.exceptions.RequestException as e:
@@ -188,8 +209,8 @@ def parse_arguments():
     parser.add_argument(
         "--batch_size",
         type=int,
-        default=1,
-        help="Batch size for inference (default: 1)",
+        default=None,
+        help="Batch size for inference (default: one frame per stream on GPU/NPU)",
     )
     parser.add_argument(
         "--tcp_port",
@@ -236,17 +257,44 @@ def parse_arguments():
         default=None,
         help="Number of columns for the compositor grid (default: None)",
     )
+    parser.add_argument(
+        "--via_rtsp",
+        action="store_true",
+        help="Relay video files through the RTSP server with ffmpeg instead of reading them directly",
+    )
+    parser.add_argument(
+        "--reencode",
+        action="store_true",
+        help="Decode and re-encode every MJPEG frame with OpenCV, for debugging only",
+    )
     return parser.parse_args()
 
 
-args = parse_arguments()
+@functools.lru_cache(maxsize=None)
+def gst_element_available(element):
+    """
+    Check whether a GStreamer element is installed.
+    """
+    try:
+        result = sp.run(
+            ["gst-inspect-1.0", "--exists", element],
+            stdout=sp.DEVNULL,
+            stderr=sp.DEVNULL,
+            timeout=10,
+        )
+        return result.returncode == 0
+    except (OSError, sp.TimeoutExpired):
+        return False
 
 
+@functools.lru_cache(maxsize=None)
 def build_compositor_props(
     num_streams, final_width, final_height, rows=None, cols=None
 ):
     """
     Method to dynamically split a single final_width * final_height compositor output window into a grid of N sub-windows.
+    Returns one pipeline token per pad property, as a tuple so the cached value
+    cannot be modified by callers.
     """
     if not rows or not cols:
         # Determine how many columns and rows a square/grid grid would need
@@ -265,11 +313,14 @@ def build_compositor_props(
         x_pos = col * sub_width
         y_pos = row * sub_height
 
-        comp_props.append(
-            f"sink_{i}::xpos={x_pos} sink_{i}::ypos={y_pos} sink_{i}::width={sub_width} sink_{i}::height={sub_height}"
-        )
+        comp_props += [
+            f"sink_{i}::xpos={x_pos}",
+            f"sink_{i}::ypos={y_pos}",
+            f"sink_{i}::width={sub_width}",
+            f"sink_{i}::height={sub_height}",
+        ]
 
-    return " ".join(comp_props)
+    return tuple(comp_props)
 
 
 def build_pipeline(
@@ -280,18 +331,28 @@ def build_pipeline(
     decode_device,
     tcp_port,
     number_of_streams=1,
-    batch_size=1,
+    batch_size=None,
     model_proc_path=None,
     model_label_path=None,
+    width_limit=640,
+    height_limit=480,
     rows=None,
     cols=None,
 ):
     """Build the DLStreamer pipeline for MJPEG streaming"""
     # Determine source element based on input
-    if input.endswith((".mp4", ".avi", ".mov")):
-        source_command = ["filesrc", f"location={input}", "loop=true"]
+    is_video_file = input.endswith((".mp4", ".avi", ".mov"))
+    if is_video_file:
+        # filesrc cannot loop, multifilesrc replays the file without an EOS
+        source_command = ["multifilesrc", f"location={input}", "loop=true"]
     elif input.startswith("rtsp://"):
-        source_command = ["rtspsrc", f"location={input}", "protocols=tcp"]
+        # Interleaved TCP cannot lose packets, RTX requests only add overhead
+        source_command = [
+            "rtspsrc",
+            f"location={input}",
+            "protocols=tcp",
+            "do-retransmission=false",
+        ]
     elif input.startswith("/dev/video"):
         if number_of_streams > 1:
             source_command = [
@@ -319,6 +380,9 @@ def build_pipeline(
                 "videoconvert",
             ]
             caps_element = ["video/x-raw"]
+        elif is_video_file:
+            decode_element = ["decodebin3", "!", "videoconvert"]
+            caps_element = ["video/x-raw,format=BGR"]
         else:
             decode_element = [
                 "rtph264depay",
@@ -329,6 +393,14 @@ def build_pipeline(
             ]
             caps_element = ["video/x-raw,format=BGR"]
     elif "GPU" in decode_device or "NPU" in decode_device:
+        va_decoder = next(
+            (
+                element
+                for element in ("vah264dec", "vah264lpdec")
+                if gst_element_available(element)
+            ),
+            None,
+        )
         if input.startswith("/dev/video"):
             decode_element = [
                 "videoconvert",
@@ -336,7 +408,11 @@ def build_pipeline(
                 "vapostproc",
             ]
             caps_element = ["video/x-raw(memory:VAMemory)"]
-        else:
+        elif is_video_file and (va_decoder is None or input.endswith(".avi")):
+            decode_element = ["decodebin3", "!", "vapostproc"]
+            caps_element = ["video/x-raw(memory:VAMemory),format=NV12"]
+        elif va_decoder is None:
+            logging.warning("VA-API H.264 decoder not found, decoding on CPU")
             decode_element = [
                 "rtph264depay",
                 "!",
@@ -345,6 +421,16 @@ def build_pipeline(
                 "vapostproc",
             ]
             caps_element = ["video/x-raw(memory:VAMemory),format=NV12"]
+        else:
+            # Hardware decode keeps frames in VA memory all the way to inference
+            decode_element = [
+                "qtdemux" if is_video_file else "rtph264depay",
+                "!",
+                "h264parse",
+                "!",
+                va_decoder,
+            ]
+            caps_element = ["video/x-raw(memory:VAMemory),format=NV12"]
     else:
         logging.error(f"Unsupported device: {decode_device}")
         return None
@@ -356,47 +442,78 @@ def build_pipeline(
     ]
 
     # if dont have model proc file then we make it use it without
-    # Add model proc file if available
-    if model_proc_path is not None and os.path.exists(model_proc_path):
+    # Add model proc file if available. main() only passes paths it found in
+    # the model directory, so they are not checked again here
+    if model_proc_path is not None:
         logging.info(f"Using model proc file: {model_proc_path}")
         inference_command.append(f"model-proc={model_proc_path}")
     else:
         logging.warning("No model proc file found. Proceeding without one.")
 
-    if model_label_path is not None and os.path.exists(model_label_path):
+    if model_label_path is not None:
         logging.info(f"Using model label file: {model_label_path}")
         inference_command.append(f"labels-file={model_label_path}")
     else:
         logging.warning("No model label file found. Proceeding without one.")
 
+    # nireq=0 lets gvadetect use the optimal number of requests reported by
+    # OpenVINO, the throughput hint lets OpenVINO pick the number of streams
+    inference_command.append("nireq=0")
+    if "CPU" in device or "GPU" in device:
+        inference_command.append("ie-config=PERFORMANCE_HINT=THROUGHPUT")
+    # Streams share one compiled model so their frames are batched together.
+    # gst-launch-1.0 re-tokenizes its arguments, keep the id to word characters
+    model_instance_name = re.sub(r"\W", "_", Path(model_full_path).stem)
+    inference_command.append(f"model-instance-id=shared_{model_instance_name}")
+
     # pre-processing
     if ("GPU" in decode_device and "GPU" in device) or (
         "NPU" in decode_device and "NPU" in device
     ):
+        # Unless set explicitly, one batch holds a frame from every stream
+        if batch_size is None:
+            batch_size = number_of_streams
         inference_command.append(f"batch-size={batch_size}")
-        inference_command.append("nireq=4")
         inference_command.append("pre-process-backend=va-surface-sharing")
-    elif "GPU" in decode_device and "CPU" in device:
+    elif "GPU" in decode_device or "NPU" in decode_device:
+        # VA memory frames feeding another device are mapped by the VA backend
         inference_command.append("pre-process-backend=va")
     else:
         inference_command.append("pre-process-backend=ie")
 
-    # beginning of piepline
-    pipeline = ["gst-launch-1.0"]
+    # Frames decoded on the GPU are converted out of VA memory on the GPU
+    # scaler before gvawatermark draws on them
+    if "GPU" in decode_device or "NPU" in decode_device:
+        download_element = ["vapostproc", "!", "video/x-raw"]
+    else:
+        download_element = ["videoconvert"]
+
+    # beginning of piepline, -e lets the pipeline drain to EOS when interrupted
+    pipeline = ["gst-launch-1.0", "-e"]
 
-    comp_props_str = build_compositor_props(
-        args.number_of_streams,
-        args.width_limit,
-        args.height_limit,
-        args.rows,
-        args.cols,
+    comp_props = build_compositor_props(
+        number_of_streams,
+        width_limit,
+        height_limit,
+        rows,
+        cols,
     )
-    comp_props = comp_props_str.split()
     logging.info(f"Compositor properties: {comp_props}")
 
-    pipeline += ["compositor", "name=comp"] + comp_props
+    # Composite and encode on the GPU when frames are decoded there and the VA
+    # elements are installed, the VA encoder reads the composited surface directly
+    compositor, jpeg_encoder = "compositor", "jpegenc"
+    if (
+        ("GPU" in decode_device or "NPU" in decode_device)
+        and gst_element_available("vacompositor")
+        and gst_element_available("vajpegenc")
+    ):
+        compositor, jpeg_encoder = "vacompositor", "vajpegenc"
+    logging.info(f"Compositor: {compositor}, JPEG encoder: {jpeg_encoder}")
+
+    pipeline += [compositor, "name=comp", *comp_props]
     pipeline += ["!", "queue"]
-    pipeline += ["!", "jpegenc"]
+    pipeline += ["!", jpeg_encoder]
     pipeline += ["!", "multipartmux", "boundary=frame"]
     pipeline += [
         "!",
@@ -405,6 +522,22 @@ def build_pipeline(
         f"port={tcp_port}",
     ]
 
+    output_elements = [
+        "!",
+        "queue",
+        "!",
+        "gvafpscounter",
+        "!",
+        *download_element,
+        "!",
+        "gvawatermark",
+        "!",
+        "videoconvert",
+        "!",
+        "video/x-raw",
+        "!",
+    ]
+
     if input.startswith("/dev/video") and number_of_streams > 1:
         # for multiple webcam streams, use tee to split the source
         pipeline.append("sync=false")
@@ -420,43 +553,24 @@ def build_pipeline(
             pipeline += ["!", *decode_element]
             pipeline += ["!", *caps_element]
             pipeline += ["!", *inference_command]
-            pipeline += [
-                "!",
-                "queue",
-                "!",
-                "gvafpscounter",
-                "!" "videoconvert",
-                "!",
-                "gvawatermark",
-                "!",
-                "videoconvert",
-                "!",
-                "video/x-raw",
-                "!",
-                f"comp.sink_{i}",
-            ]
+            pipeline += output_elements + [f"comp.sink_{i}"]
+    elif is_video_file and number_of_streams > 1:
+        # Demux and decode the file once, then fan the decoded frames out
+        pipeline += source_command
+        pipeline += ["!", *decode_element]
+        pipeline += ["!", *caps_element]
+        pipeline += ["!", "tee", "name=filetee"]
+        for i in range(number_of_streams):
+            pipeline += ["filetee.", "!", "queue"]
+            pipeline += ["!", *inference_command]
+            pipeline += output_elements + [f"comp.sink_{i}"]
     else:
         for i in range(number_of_streams):
             pipeline += source_command
             pipeline += ["!", *decode_element]
             pipeline += ["!", *caps_element]
             pipeline += ["!", *inference_command]
-            pipeline += [
-                "!",
-                "queue",
-                "!",
-                "gvafpscounter",
-                "!",
-                "videoconvert",
-                "!",
-                "gvawatermark",
-                "!",
-                "videoconvert",
-                "!",
-                "video/x-raw",
-                "!",
-                f"comp.sink_{i}",
-            ]
+            pipeline += output_elements + [f"comp.sink_{i}"]
 
     # log the pipepline
     logging.info(f"Full pipeling: {' '.join(pipeline)}\n")
@@ -465,28 +579,36 @@ def build_pipeline(
 
 def run_pipeline(pipeline):
     """
-    Run the GStreamer pipeline and process its output in real-time.
-    Handles EOS for looping and updates pipeline metrics.
+    Run the GStreamer pipeline and process its output in real-time and update
+    the pipeline metrics. Video files are looped inside the pipeline by multifilesrc,
+    so gst-launch-1.0 only exits at the end of a live source or on error.
     """
     logging.info("Starting GStreamer pipeline...")
+    process = None
     try:
-        process = sp.Popen(pipeline, stdout=sp.PIPE, stderr=sp.PIPE, text=True)
-        # Monitor the pipeline's stdout
-        for line in process.stdout:
-            logging.info(line.strip())
-            # Process each line of output using filter_result
-            metrics = filter_result_fps(line.strip())
-            if metrics:
-                app.state.pipeline_metrics.update(metrics)
-
-        # Capture any errors from stderr
-        for error_line in process.stderr:
-            logging.error(error_line.strip())
+        process = sp.Popen(pipeline, stdout=sp.PIPE, stderr=sp.PIPE, bufsize=0)
+        # Drain stdout and stderr together, a full stderr pipe would otherwise
+        # stall gst-launch-1.0 while only stdout is being read
+        with selectors.DefaultSelector() as selector:
+            selector.register(process.stdout, selectors.EVENT_READ, logging.INFO)
+            selector.register(process.stderr, selectors.EVENT_READ, logging.ERROR)
+            pending = {process.stdout: b"", process.stderr: b""}
+            while selector.get_map():
+                for key, _ in selector.select():
+                    chunk = os.read(key.fd, 65536)
+                    if not chunk:
+                        selector.unregister(key.fileobj)
+                        process_pipeline_line(pending[key.fileobj], key.data)
+                        continue
+                    buffered = pending[key.fileobj] + chunk
+                    *lines, pending[key.fileobj] = buffered.split(b"\n")
+                    for line in lines:
+                        process_pipeline_line(line, key.data)
+        process.wait()
 
         # Check if the process exited due to EOS
-        if process.returncode == 0 or process.returncode is None:
-            logging.info("Pipeline reached EOS. Restarting...")
-            process.communicate()
+        if process.returncode == 0:
+            logging.info("Pipeline reached EOS.")
         else:
             logging.error(f"Pipeline exited with error code: {process.returncode}")
 
@@ -501,6 +623,25 @@ def run_pipeline(pipeline):
             process.wait()
 
 
+def process_pipeline_line(line: bytes, level):
+    """
+    Log one line of pipeline output and update the metrics from FPS lines.
+    """
+    line = line.strip()
+    if not line:
+        return
+    if b"FpsCounter(" in line:
+        # gvafpscounter output is plain ASCII, skip the UTF-8 codec for it
+        text = line.decode("ascii", errors="replace")
+        logging.log(level, text)
+        metrics = filter_result_fps(text)
+        if metrics:
+            app.state.pipeline_metrics.update(metrics)
+    elif logging.getLogger().isEnabledFor(level):
+        # Other gst-launch-1.0 chatter is only decoded when it is actually logged
+        logging.log(level, line.decode(errors="replace"))
+
+
 def stop_signal_handler(sig, frame):
     """
     Signal handler for SIGINT to terminate worker gracefully.
@@ -517,17 +658,14 @@ def stop_signal_handler(sig, frame):
     sys.exit(0)
 
 
-signal.signal(signal.SIGINT, stop_signal_handler)
-
-
 def filter_result_fps(output):
     """
     Extract the FPS metrics from the command output
     """
-    fps_pattern = re.compile(
-        r"FpsCounter\(.*\): total=(\d+\.\d+) fps, number-streams=(\d+), per-stream=(\d+\.\d+) fps(?: \((.*?)\))?"
-    )
-    match = fps_pattern.search(output)
+    # Most pipeline output is not FPS related, skip it before running the regex
+    if "FpsCounter(" not in output:
+        return None
+    match = FPS_PATTERN.search(output)
     if match:
         total_fps = float(match.group(1))
         number_streams = int(match.group(2))
@@ -554,36 +692,102 @@ def filter_result_fps(output):
     return None
 
 
-def is_rtsp_stream_running(rtsp_url, retries=5, delay=1):
+def is_rtsp_stream_running(rtsp_url, timeout=5.0, delay=0.05, max_delay=0.4):
     """
-    Check if an RTSP stream is running by attempting to connect to it.
+    Check if an RTSP stream is being published with a lightweight RTSP DESCRIBE
+    request, no decoder is opened. Retry with exponential backoff from delay up to
+    max_delay seconds until timeout seconds have elapsed.
     """
-    for attempt in range(retries):
+    parsed_url = urllib.parse.urlparse(rtsp_url)
+    address = (parsed_url.hostname, parsed_url.port or 554)
+    # Never put credentials on the wire in the request line
+    netloc = parsed_url.netloc.rpartition("@")[2]
+    request_url = urllib.parse.urlunparse(parsed_url._replace(netloc=netloc))
+    # DESCRIBE rather than OPTIONS, mediamtx answers OPTIONS even before a
+    # publisher is connected but only describes streams that exist
+    request = (
+        f"DESCRIBE {request_url} RTSP/1.0\r\nCSeq: 1\r\nAccept: application/sdp\r\n\r\n"
+    ).encode()
+    # The local relay must have a publisher, an external camera that asks for
+    # authentication is up and the pipeline authenticates with the URL userinfo
+    accepted = (b"RTSP/1.0 200",)
+    if not rtsp_url.startswith(RSTP_SERVER_URL):
+        accepted += (b"RTSP/1.0 401",)
+    deadline = time.monotonic() + timeout
+    attempt = 0
+    while True:
+        attempt += 1
         try:
-            cap = cv2.VideoCapture(rtsp_url)
-            if cap.isOpened():
-                ret, _ = cap.read()
-                cap.release()
+            with socket.create_connection(address, timeout=0.5) as probe_socket:
+                probe_socket.sendall(request)
+                response = probe_socket.recv(1024)
+            if response.startswith(accepted):
+                logging.info(f"RTSP stream is running at: {request_url}")
                 return True
-            else:
-                logging.warning(
-                    f"RTSP stream not ready at {rtsp_url}, attempt {attempt+1}/{retries}"
-                )
-        except Exception as e:
-            logging.error(
-                f"Error checking RTSP stream: {e}. Retrying ... ({attempt + 1}/{retries})"
-            )
-        time.sleep(delay)
+        except OSError as e:
+            logging.debug(f"Error checking RTSP stream: {e} (attempt {attempt})")
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            break
+        time.sleep(min(delay, remaining))
+        delay = min(delay * 2, max_delay)
+    logging.warning(
+        f"RTSP stream is not running at: {request_url} after {attempt} attempts"
+    )
     return False
 
 
+def find_model_files(directory, extensions=(".xml", ".json", ".txt")):
+    """
+    Scan a model directory once and return the first file found for each extension,
+    or None for the extensions without a match.
+    """
+    model_files = dict.fromkeys(extensions)
+    try:
+        with os.scandir(directory) as entries:
+            for entry in entries:
+                extension = os.path.splitext(entry.name)[1]
+                if model_files.get(extension, "") is None and entry.is_file():
+                    model_files[extension] = Path(entry.path)
+    except OSError as e:
+        logging.warning(f"Failed to scan model directory {directory}: {e}")
+    return model_files
+
+
+def sniff_video_container(filepath):
+    """
+    Check the first bytes of a regular file against known video container signatures.
+    Return True or False for a recognised signature, None when the format is unknown.
+    """
+    try:
+        with open(filepath, "rb") as f:
+            header = f.read(12)
+    except OSError:
+        return False
+    if header[4:8] == b"ftyp":
+        # MP4, MOV and other ISO base media files
+        return True
+    if header[:4] == b"RIFF":
+        return header[8:12] == b"AVI "
+    if header.startswith((b"\x1a\x45\xdf\xa3", b"FLV")):
+        # Matroska/WebM and FLV
+        return True
+    return None
+
+
 def is_valid_video_file(filepath):
     """
-    Check if a file exists and is a valid video file.
+    Check if a file exists and is a valid video file. Regular files are identified
+    by their container signature, OpenCV is only used for unknown formats and devices.
     """
     if not os.path.exists(filepath):
         return False
 
+    if os.path.isfile(filepath):
+        is_video = sniff_video_container(filepath)
+        if is_video is not None:
+            return is_video
+
     try:
         cap = cv2.VideoCapture(filepath)
         opened = cap.isOpened()
@@ -593,67 +797,198 @@ def is_valid_video_file(filepath):
         return False
 
 
-def mjpeg_stream(
-    host: str = "127.0.0.1", port: int = 5001, retries: int = 5, delay: int = 1
+def parse_content_length(headers: bytes):
+    """
+    Return the Content-Length of a multipart part header block, if present.
+    """
+    for line in headers.split(b"\r\n"):
+        name, _, value = line.partition(b":")
+        if name.strip().lower() == b"content-length":
+            try:
+                return int(value.strip())
+            except ValueError:
+                return None
+    return None
+
+
+def find_mjpeg_part(buffer, start, end):
+    """
+    Locate the next complete multipart part in buffer[start:end].
+    Returns (body_start, body_end, next_part) or None if more data is needed.
+    """
+    header_end = buffer.find(b"\r\n\r\n", start, end)
+    if header_end == -1:
+        return None
+    body_start = header_end + 4
+
+    # multipartmux announces the part size, fall back to the next boundary if
+    # it does not
+    content_length = parse_content_length(buffer[start:header_end])
+    if content_length is not None:
+        body_end = body_start + content_length
+        if body_end > end:
+            return None
+        return body_start, body_end, body_end
+
+    body_end = buffer.find(b"\r\n--frame", body_start, end)
+    if body_end == -1:
+        return None
+    return body_start, body_end, body_end + 2
+
+
+def reencode_jpeg(frame: bytes):
+    """
+    Decode and re-encode a JPEG frame with OpenCV, for debugging the pipeline output.
+    """
+    try:
+        image = cv2.imdecode(np.frombuffer(frame, dtype=np.uint8), cv2.IMREAD_COLOR)
+        if image is None:
+            return None
+        _, jpeg_frame = cv2.imencode(".jpg", image)
+        return jpeg_frame.tobytes()
+    except Exception as e:
+        logging.error(f"Error processing frame: {e}")
+        return None
+
+
+async def relay_mjpeg_stream(loop, client_socket):
+    """
+    Forward the multipart MJPEG stream from the GStreamer TCP server unmodified.
+    """
+    boundary = b"--frame\r\n"
+    # tcpserversink can start a new client in the middle of a part, drop
+    # everything before the first boundary
+    buffer = b""
+    while True:
+        data = await asyncio.wait_for(loop.sock_recv(client_socket, 65536), 5)
+        if not data:
+            return
+        buffer += data
+        start = buffer.find(boundary)
+        if start != -1:
+            yield buffer[start:]
+            break
+        # Keep the tail in case a boundary is split across reads
+        buffer = buffer[-(len(boundary) - 1) :]
+
+    # multipartmux already emits a multipart/x-mixed-replace body with the
+    # same boundary, forward the bytes without parsing them
+    while True:
+        data = await asyncio.wait_for(loop.sock_recv(client_socket, 65536), 5)
+        if not data:
+            return
+        yield data
+
+
+async def reencode_mjpeg_stream(loop, client_socket):
+    """
+    Split the multipart MJPEG stream from the GStreamer TCP server into frames and
+    yield the newest frame of every read re-encoded with OpenCV.
+    """
+    buffer = bytearray(MJPEG_BUFFER_SIZE)
+    view = memoryview(buffer)
+    read_pos = write_pos = 0
+
+    while True:
+        if write_pos == len(buffer):
+            if read_pos:
+                # Move the unconsumed tail to the front, only done
+                # once the buffer is full
+                tail = bytes(view[read_pos:write_pos])
+                buffer[: len(tail)] = tail
+                read_pos, write_pos = 0, len(tail)
+            else:
+                # A single part is larger than the buffer
+                view.release()
+                buffer.extend(bytes(len(buffer)))
+                view = memoryview(buffer)
+
+        # Read data from the TCP server straight into the buffer
+        received = await asyncio.wait_for(
+            loop.sock_recv_into(client_socket, view[write_pos:]), 5
+        )
+        if not received:
+            return
+        write_pos += received
+
+        # Only the newest complete frame is re-encoded, older frames that piled
+        # up while the HTTP client was slow are dropped instead of delivered late
+        latest = None
+        stale_frames = 0
+        while True:
+            part = find_mjpeg_part(buffer, read_pos, write_pos)
+            if part is None:
+                break
+            body_start, body_end, read_pos = part
+            if not (
+                view[body_start : body_start + 2] == b"\xff\xd8"
+                and view[body_end - 2 : body_end] == b"\xff\xd9"
+            ):
+                logging.info("Skipping incomplete JPEG frame")
+                continue
+            if latest is not None:
+                stale_frames += 1
+            latest = (body_start, body_end)
+
+        if latest is None:
+            continue
+        if stale_frames:
+            logging.debug(f"Dropped {stale_frames} stale MJPEG frames")
+
+        frame = bytes(view[latest[0] : latest[1]])
+        frame = await asyncio.to_thread(reencode_jpeg, frame)
+        if frame is None:
+            continue
+
+        yield (b"--frame\r\n" b"Content-Type: image/jpeg\r\n\r\n" + frame + b"\r\n")
+
+
+async def mjpeg_stream(
+    host: str = "127.0.0.1",
+    port: int = 5001,
+    retries: int = 5,
+    delay: int = 1,
+    reencode: bool = False,
 ):
     """
-    Connect to the GStreamer TCP server and yield MJPEG frames.
+    Connect to the GStreamer TCP server and yield its MJPEG stream, relayed as is
+    unless the frames have to be re-encoded.
     """
+    loop = asyncio.get_running_loop()
     for attempt in range(retries):
         try:
             with socket.socket(socket.AF_INET, socket.SOCK_STREAM) as client_socket:
-                client_socket.settimeout(5)
-                client_socket.connect((host, port))
+                client_socket.setblocking(False)
+                client_socket.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+                client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_RCVBUF, 1 << 20)
+                await asyncio.wait_for(
+                    loop.sock_connect(client_socket, (host, port)), 5
+                )
                 logging.info(f"Connected to MJPEG stream on port {port}")
-                buffer = b""
-
-                while True:
-                    # Read data from the TCP server
-                    data = client_socket.recv(4096)
-                    if not data:
-                        break
-
-                    buffer += data
-
-                    while b"\r\n\r\n" in buffer:
-                        frame, _, buffer = buffer.partition(b"\r\n\r\n")
-
-                        try:
-                            # Convert raw frame data to a NumPy array and decode the frame
-                            np_frame = np.frombuffer(frame, dtype=np.uint8)
-                            image = cv2.imdecode(np_frame, cv2.IMREAD_COLOR)
-                            if image is None:
-                                continue
-
-                            _, jpeg_frame = cv2.imencode(".jpg", image)
-
-                            # Yield the encoded JPEG frame
-                            yield (
-                                b"--frame\r\n"
-                                b"Content-Type: image/jpeg\r\n\r\n"
-                                + jpeg_frame.tobytes()
-                                + b"\r\n"
-                            )
-                        except Exception as e:
-                            logging.error(f"Error processing frame: {e}")
+                if reencode:
+                    chunks = reencode_mjpeg_stream(loop, client_socket)
+                else:
+                    chunks = relay_mjpeg_stream(loop, client_socket)
+                async for chunk in chunks:
+                    yield chunk
 
         except ConnectionRefusedError:
             logging.warning(
                 f"Connection refused. Retrying in {delay}s... ({attempt + 1}/{retries})"
             )
-            time.sleep(delay)
-        except (socket.timeout, BrokenPipeError, ConnectionResetError) as e:
+            await asyncio.sleep(delay)
+        except (asyncio.TimeoutError, BrokenPipeError, ConnectionResetError) as e:
             logging.error(
                 f"Socket error: {e}. Retrying in {delay}s... ({attempt + 1}/{retries})"
             )
-            time.sleep(delay)
+            await asyncio.sleep(delay)
         except Exception as e:
             logging.error(f"An unexpected error occurred in MJPEG stream: {e}")
             break
     logging.error(
         f"Failed to connect to MJPEG stream on port {port} after {retries} attempts."
     )
-    update_payload_status(args.id, status="failed")
+    await asyncio.to_thread(update_payload_status, app.state.args.id, status="failed")
     yield b"--frame\r\nContent-Type: text/plain\r\n\r\nStream not available. Check worker logs.\r\n"
 
 
@@ -661,6 +996,7 @@ def main():
     """
     Main function to start the GStreamer pipeline.
     """
+    args = app.state.args
 
     model_proc_path = None
     model_label_path = None
@@ -698,40 +1034,44 @@ def main():
             )
             update_payload_status(args.id, status="failed")
             exit(1)
-        filename = os.path.splitext(os.path.basename(args.input))[0]
-        rtsp_url = f"{RSTP_SERVER_URL}/{filename}-{args.id}"
-        logging.info(f"Hosting RTSP stream at: {rtsp_url}")
-        ffmpeg_command = [
-            "ffmpeg",
-            "-re",
-            "-stream_loop",
-            "-1",
-            "-i",
-            args.input,
-            "-c",
-            "copy",
-            "-f",
-            "rtsp",
-            "-rtsp_transport",
-            "tcp",
-            rtsp_url,
-        ]
-        args.input = rtsp_url
+        # multifilesrc loops the file inside the pipeline, only relay it through
+        # the RTSP server when explicitly requested
+        if args.via_rtsp:
+            filename = os.path.splitext(os.path.basename(args.input))[0]
+            rtsp_url = f"{RSTP_SERVER_URL}/{filename}-{args.id}"
+            logging.info(f"Hosting RTSP stream at: {rtsp_url}")
+            ffmpeg_command = [
+                "ffmpeg",
+                "-re",
+                "-stream_loop",
+                "-1",
+                "-i",
+                args.input,
+                "-c",
+                "copy",
+                "-f",
+                "rtsp",
+                "-rtsp_transport",
+                "tcp",
+                rtsp_url,
+            ]
+            args.input = rtsp_url
 
-        try:
-            ffmpeg_process = sp.Popen(
-                ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL
-            )
-            logging.info(f"Started RTSP streaming with PID: {ffmpeg_process.pid}")
-        except sp.CalledProcessError as e:
-            logging.error(f"Failed to host RTSP stream: {e}")
+            try:
+                ffmpeg_process = sp.Popen(
+                    ffmpeg_command, stdout=sp.DEVNULL, stderr=sp.DEVNULL
+                )
+                logging.info(f"Started RTSP streaming with PID: {ffmpeg_process.pid}")
+            except sp.CalledProcessError as e:
+                logging.error(f"Failed to host RTSP stream: {e}")
 
-    if not is_rtsp_stream_running(args.input, retries=5, delay=1):
-        logging.error("RTSP stream is not running after multiple attempts. Exiting...")
-        update_payload_status(args.id, status="failed")
-        exit(1)
-    else:
-        time.sleep(5)
+    if args.input.startswith("rtsp://"):
+        if not is_rtsp_stream_running(args.input):
+            logging.error(
+                "RTSP stream is not running after multiple attempts. Exiting..."
+            )
+            update_payload_status(args.id, status="failed")
+            exit(1)
 
     if args.model in SEGMENTATION_MODELS:
         model_status = export_model(
@@ -743,24 +1083,21 @@ def main():
 
         model_dir = Path(args.model_parent_dir) / args.model
 
-        xml_files = list((model_dir / args.model_precision).glob("*.xml"))
-        if xml_files:
-            model_full_path = xml_files[0]
-        else:
+        model_full_path = find_model_files(model_dir / args.model_precision)[".xml"]
+        if not model_full_path:
             logging.error(f"No model files found in {model_dir / args.model_precision}")
             update_payload_status(args.id, status="failed")
             exit(1)
 
-        proc_files = list(model_dir.glob("*.json"))
-        if proc_files:
-            model_proc_path = proc_files[0]
+        model_files = find_model_files(model_dir)
+        model_proc_path = model_files[".json"]
+        if model_proc_path:
             logging.info(f"Found model proc file: {model_proc_path}")
         else:
             logging.warning(f"No model proc file found in {model_dir}")
 
-        label_files = list(model_dir.glob("*.txt"))
-        if label_files:
-            model_label_path = label_files[0]
+        model_label_path = model_files[".txt"]
+        if model_label_path:
             logging.info(f"Found model label file: {model_label_path}")
         else:
             logging.warning(f"No model label file found in {model_dir}")
@@ -782,27 +1119,21 @@ def main():
                 f"Model directory {model_extract_dir} already exists, skipping extraction."
             )
 
-        # Find for .xml file
-        xml_files = list((model_extract_dir).glob("*.xml"))
-        if not xml_files:
+        # Find the .xml, model proc and model label files in a single scan
+        model_files = find_model_files(model_extract_dir)
+        model_full_path = model_files[".xml"]
+        if not model_full_path:
             logging.error(f"No model XML files found in {model_extract_dir}.")
             update_payload_status(args.id, status="failed")
             exit(1)
-        model_full_path = xml_files[0]
 
-        # Find model proc file
-        proc_files = list(model_extract_dir.glob("*.json"))
-        if proc_files:
-            model_proc_path = proc_files[0]
-        else:
+        model_proc_path = model_files[".json"]
+        if not model_proc_path:
             logging.warning(f"No model processing file found in {model_extract_dir}")
 
-        # find model label file
-        label_files = list(model_extract_dir.glob("*.txt"))
-        if label_files:
-            model_label_path = proc_files[0]
-        else:
-            logging.warning(f"No model processing file found in {model_extract_dir}")
+        model_label_path = model_files[".txt"]
+        if not model_label_path:
+            logging.warning(f"No model label file found in {model_extract_dir}")
     else:
         # Handle custom model uploaded to directory
         custom_model_path = CUSTOM_MODELS_DIR / args.model
@@ -823,19 +1154,14 @@ def main():
             )
 
         else:
-            custom_model_files = list(custom_model_path.glob("*.xml"))
-            if not custom_model_files:
+            model_files = find_model_files(custom_model_path)
+            model_full_path = model_files[".xml"]
+            if not model_full_path:
                 logging.error(f"No model XML files found in {custom_model_path}.")
                 update_payload_status(args.id, status="failed")
                 exit(1)
-            model_full_path = custom_model_files[0]
-            proc_files = list(custom_model_path.glob("*.json"))
-            if proc_files:
-                model_proc_path = proc_files[0]
-
-            label_files = list(custom_model_path.glob("*.txt"))
-            if label_files:
-                model_label_path = proc_files[0]
+            model_proc_path = model_files[".json"]
+            model_label_path = model_files[".txt"]
 
     # Build the pipeline
     pipeline = build_pipeline(
@@ -848,6 +1174,11 @@ def main():
         device=args.device,
         decode_device=args.decode_device,
         number_of_streams=args.number_of_streams,
+        batch_size=args.batch_size,
+        width_limit=args.width_limit,
+        height_limit=args.height_limit,
+        rows=args.rows,
+        cols=args.cols,
     )
 
     # Start the pipeline
@@ -863,13 +1194,15 @@ def main():
 
 
 @app.get("/result")
-def get_mjpeg_stream():
+async def get_mjpeg_stream():
     """
     Serve the MJPEG stream as an HTTP response
     """
     try:
         return StreamingResponse(
-            mjpeg_stream(port=args.tcp_port),
+            mjpeg_stream(
+                port=app.state.args.tcp_port, reencode=app.state.args.reencode
+            ),
             media_type="multipart/x-mixed-replace; boundary=frame",
         )
     except Exception as e:
@@ -899,4 +1232,10 @@ def get_pipeline_metrics():
 
 
 if __name__ == "__main__":
-    uvicorn.run("main:app", host="127.0.0.1", port=args.port)
+    args = parse_arguments()
+    setup_env()
+    signal.signal(signal.SIGINT, stop_signal_handler)
+    app.state.args = args
+    # Serve this app object instead of letting uvicorn import the module
+    # again by name
+    uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=args.port)).run()
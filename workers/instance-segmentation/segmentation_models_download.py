@@ -3,14 +3,18 @@
 
 import os
 import sys
+import stat
 import shutil
 import logging
 import argparse
+import collections
+import subprocess
 import openvino as ov
-import subprocess as np
 from urllib.parse import urlparse
 import urllib.request
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 
 from pathlib import Path
 from ultralytics import YOLO
@@ -41,12 +45,22 @@ SEGMENTATION_MODELS = {
     "yolov8l-seg": "YOLOv8-SEG",
     "yolov8x-seg": "YOLOv8-SEG",
 }
+AVAILABLE_MODELS = ", ".join(SEGMENTATION_MODELS)
 
 
 # Define the MODELS_DIR environment variable
 BASE_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '../../frontend'))
 MODELS_DIR = os.path.join(BASE_DIR, 'models')
 
+# Download session, urllib3 retries transient failures with backoff over pooled connections
+DOWNLOAD_SESSION = requests.Session()
+DOWNLOAD_SESSION.mount(
+    "https://",
+    HTTPAdapter(
+        max_retries=Retry(total=3, backoff_factor=0.5, status_forcelist=[500, 502, 503, 504])
+    ),
+)
+
 def ensure_venv_in_path():
     venv_bin = str(Path(sys.executable).parent)
     path_val = os.environ.get("PATH", "")
@@ -68,19 +82,50 @@ def is_path_safe(base_dir: Path, path: Path) -> bool:
 
 
 def model_files_exist_and_safe(model_path_fp32: Path, model_path_fp16: Path) -> bool:
-    if model_path_fp32.exists() and model_path_fp16.exists():
-        logging.info(f"Model already exists: {model_path_fp32} and {model_path_fp16}")
-        if os.path.realpath(model_path_fp32) != os.path.abspath(model_path_fp32) or os.path.realpath(model_path_fp16) != os.path.abspath(model_path_fp16):
-            logging.info(f"Error: Model file is a symlink. Refusing to open for security reasons.")
-            return False
-        return True
-    return False
+    # A single lstat per file tells both whether it exists and whether it is a symlink
+    model_paths = (model_path_fp32, model_path_fp16)
+    try:
+        modes = [os.lstat(path).st_mode for path in model_paths]
+    except OSError:
+        return False
+    logging.info(f"Model already exists: {model_path_fp32} and {model_path_fp16}")
+    # The parent directories are still resolved to reject symlinks further up the path
+    if any(
+        stat.S_ISLNK(mode) or os.path.realpath(path.parent) != os.path.abspath(path.parent)
+        for path, mode in zip(model_paths, modes)
+    ):
+        logging.info(f"Error: Model file is a symlink. Refusing to open for security reasons.")
+        return False
+    return True
+
+
+def run_command(command, tail_lines=200):
+    """
+    Run a command and log its output while it runs instead of buffering all of it.
+    Return the exit code and the last tail_lines lines of output for error reporting.
+    """
+    output_tail = collections.deque(maxlen=tail_lines)
+    with subprocess.Popen(
+        command,
+        stdout=subprocess.PIPE,
+        stderr=subprocess.STDOUT,
+        text=True,
+        errors="replace",
+        bufsize=1,
+    ) as process:
+        for line in process.stdout:
+            line = line.rstrip()
+            logging.info(line)
+            output_tail.append(line)
+    return process.returncode, "\n".join(output_tail)
 
 def export_model(model_name, model_parent_dir=MODELS_DIR):
-    if model_name in SEGMENTATION_MODELS and model_name.startswith("yolo"):
-        return export_yolo_model(model_name, model_parent_dir)
-    else:
-        return export_omz_model(model_name, model_parent_dir)
+    exporter = MODEL_EXPORTERS.get(model_name)
+    if exporter is None:
+        logging.error(f"Error: Invalid model name '{model_name}'.")
+        logging.info(f"Available models: {AVAILABLE_MODELS}")
+        return False
+    return exporter(model_name, model_parent_dir)
 
 def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
     if model_name not in SEGMENTATION_MODELS:
@@ -91,8 +136,8 @@ def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
     model_dir = base_dir / model_name
     fp32_dir = model_dir / "FP32"
     fp16_dir = model_dir / "FP16"
-    os.makedirs(fp32_dir, exist_ok=True)
-    os.makedirs(fp16_dir, exist_ok=True)
+    for precision_dir in (fp32_dir, fp16_dir):
+        precision_dir.mkdir(parents=True, exist_ok=True)
 
     model_path_FP32 = fp32_dir / f"{model_name}.xml"
     model_path_FP16 = fp16_dir / f"{model_name}.xml"
@@ -113,9 +158,9 @@ def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
         ]
         
         logging.info(download_model)
-        result = np.run(download_model, capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.error(f"Download failed: {result.stderr}")
+        returncode, output = run_command(download_model)
+        if returncode != 0:
+            logging.error(f"Download failed: {output}")
             return False
 
         # Convert model
@@ -128,9 +173,9 @@ def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
         
         logging.info(convert_model)
         
-        result = np.run(convert_model, capture_output=True, text=True)
-        if result.returncode != 0:
-            logging.error(f"Conversion failed: {result.stderr}")
+        returncode, output = run_command(convert_model)
+        if returncode != 0:
+            logging.error(f"Conversion failed: {output}")
             return False
 
         # Move converted files to FP32/FP16 folders if needed
@@ -138,8 +183,9 @@ def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
             converted_path = model_dir / "public" / model_name / precision
             logging.info(converted_path)
             if converted_path.exists():
-                for file in converted_path.glob("*"):
-                    shutil.move(str(file), str(model_dir / precision / file.name))
+                # Same filesystem as the destination, a rename moves no data
+                for file in converted_path.iterdir():
+                    os.replace(file, model_dir / precision / file.name)
         shutil.rmtree(str(model_dir / "public"))
         logging.info(f"Model saved: {model_path_FP32} and {model_path_FP16}")
         
@@ -155,19 +201,16 @@ def export_omz_model(model_name, model_parent_dir=MODELS_DIR):
             if parse_url.netloc not in allowed_domains:
                 logging.error(f"Blocked download from untrusted domain: {parse_url.netloc}")
                 return False
-            for attempt in range(3):
-                try:
-                    res = requests.get(url, timeout=30, stream=True)
+            try:
+                with DOWNLOAD_SESSION.get(url, timeout=30, stream=True) as res:
                     res.raise_for_status()
+                    # Let urllib3 undo any Content-Encoding while copying the raw stream
+                    res.raw.decode_content = True
                     with open(model_proc_path, "wb") as out_file:
-                        for chunk in res.iter_content(chunk_size=8192):
-                            out_file.write(chunk)    
-                    logging.info(f"Downloaded mask-rcnn model processing file to {model_proc_path}")
-                    break
-                except Exception as e:
-                    logging.warning(f"mask-rcnn model processing file download attempt {attempt+1}: {e}")
-            else:
-                logging.error("Failed to download mask-rcnn model processing file")
+                        shutil.copyfileobj(res.raw, out_file, length=1 << 20)
+                logging.info(f"Downloaded mask-rcnn model processing file to {model_proc_path}")
+            except Exception as e:
+                logging.error(f"Failed to download mask-rcnn model processing file: {e}")
                 return False
         else:
             logging.info(f"Model proc file already exists: {model_proc_path[0]}")
@@ -186,7 +229,7 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
     # Validate the model name
     if model_name not in SEGMENTATION_MODELS:
         logging.error(f"Error: Invalid model name '{model_name}'.")
-        logging.info(f"Available models: {', '.join(SEGMENTATION_MODELS.keys())}")
+        logging.info(f"Available models: {AVAILABLE_MODELS}")
         return False
 
     # Retrieve the model type
@@ -196,17 +239,20 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
     base_dir = Path(model_parent_dir).resolve()
     model_dir = base_dir / model_name 
     
-    #create directories
-    os.makedirs(model_dir, exist_ok=True)
-    os.makedirs(model_dir / "FP32", exist_ok=True)
-    os.makedirs(model_dir / "FP16", exist_ok=True)
+    fp32_dir = model_dir / "FP32"
+    fp16_dir = model_dir / "FP16"
+
+    #create directories, model_dir is created as the parent of the first one
+    for precision_dir in (fp32_dir, fp16_dir):
+        precision_dir.mkdir(parents=True, exist_ok=True)
 
-    model_path_FP32 = model_dir / "FP32" / f"{model_name}.xml"
-    model_path_FP16 = model_dir / "FP16" / f"{model_name}.xml"
+    model_path_FP32 = fp32_dir / f"{model_name}.xml"
+    model_path_FP16 = fp16_dir / f"{model_name}.xml"
 
-    # Validate all paths are within the base directory
-    for p in [model_dir, model_dir / "FP32", model_dir / "FP16", model_path_FP32, model_path_FP16]:
-        if not is_path_safe(base_dir, p):
+    # Validate all paths are within the base directory, base_dir is already resolved
+    base_dir_str = str(base_dir)
+    for p in [model_dir, fp32_dir, fp16_dir, model_path_FP32, model_path_FP16]:
+        if not str(p.resolve(strict=False)).startswith(base_dir_str):
             logging.error(f"Unsafe model path detected: {p}")
             sys.exit(1)
 
@@ -219,24 +265,20 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
     logging.info(f"Downloading and converting: {model_name}")
     
     try:
-        #download and convert the model
-        current_dir = os.getcwd()
-        
-        os.chdir(model_dir)
-        
-        #download model
+        #download model, ultralytics fetches a missing asset to the given path so
+        #the weights land in model_dir without changing the working directory
+        pt_file = model_dir / f"{model_name}.pt"
         logging.info(f"Downloading {model_name}.pt using ultralytics...")
-        model = YOLO(f"{model_name}.pt")
+        model = YOLO(str(pt_file))
         model.info()
         
-        #export to openvino format
+        #export to openvino format, written next to the weights in model_dir
         logging.info(f"Exporting {model_name} to OpenVINO format...")
         converted_path = Path(model.export(format="openvino")).resolve()
         
         #validate converted part is safe
-        if not is_path_safe(Path.cwd(), converted_path):
+        if not is_path_safe(model_dir, converted_path):
             logging.error(f"Unsafe converted path detected: {converted_path}")
-            os.chdir(current_dir)
             return False 
         
         #load coverted model
@@ -263,22 +305,24 @@ def export_yolo_model(model_name, model_parent_dir=MODELS_DIR):
         
         #clean up temp files
         shutil.rmtree(str(converted_path))
-        pt_file = Path(f"{model_name}.pt").resolve()
         if pt_file.exists():
             os.remove(pt_file)
             logging.info(f"Removed {pt_file}")
         
-        #return to originas director
-        os.chdir(current_dir)
         logging.info(f"Model saved: {model_path_FP32} and {model_path_FP16}")
         return True
     
     except Exception as e:
         logging.error(f"Error exporting YOLO model {model_name}: {e}")
-        if "current_dir" in locals():
-            os.chdir(current_dir)
         return False        
-        
+
+
+# Exporter for each supported model, resolved once instead of on every export
+MODEL_EXPORTERS = {
+    model_name: export_yolo_model if model_name.startswith("yolo") else export_omz_model
+    for model_name in SEGMENTATION_MODELS
+}
+
 
 def parse_arguments():
     """
@@ -296,7 +340,7 @@ def parse_arguments():
     # Validate model_name
     if args.model_name not in SEGMENTATION_MODELS:
         logging.info(f"Error: Invalid model name '{args.model_name}'.")
-        logging.info("Available models:", ", ".join(SEGMENTATION_MODELS.keys()))
+        logging.info(f"Available models: {AVAILABLE_MODELS}")
         sys.exit(1)
     return args
 
@@ -3,26 +3,30 @@
 
 import os
 import sys
+import asyncio
+import shutil
 import logging
 import uvicorn
 import zipfile
 import argparse
 import platform
+import collections
 import requests
+import threading
 import subprocess
 import urllib.parse
 import openvino_genai
-import huggingface_hub
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 from typing import Dict
 from fastapi import FastAPI
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse
 from fastapi.middleware.cors import CORSMiddleware
-from modelscope.hub.snapshot_download import snapshot_download
+from starlette.concurrency import run_in_threadpool
 
 
 logging.basicConfig(
@@ -31,9 +35,25 @@ logging.basicConfig(
 )
 
 MODELS_DIR = Path("models")
+OV_CACHE_DIR = MODELS_DIR / "ov_cache"
 CUSTOM_MODEL_DIR = Path("../custom_models/text-generation")
 ENV_PATH = Path("../../frontend/.env")
 PIPE = None
+# Weight and graph files worth prefetching before the pipeline loads
+MODEL_FILE_SUFFIXES = (".bin", ".xml", ".onnx")
+# Substrings marking a repo that already ships OpenVINO IR
+OPENVINO_MODEL_KEYWORDS = ("openvino", "ov")
+IS_WINDOWS = platform.system() == "Windows"
+# LLMPipeline is not re-entrant, generations run one at a time
+PIPE_LOCK = threading.Lock()
+# With --max-batch-size above 1, concurrent /infer prompts arriving within
+# MAX_BATCH_WAIT_S share one generate call
+MAX_BATCH_WAIT_S = 0.008
+# Reused for every status update so the TCP connection to the backend is kept alive
+STATUS_SESSION = requests.Session()
+STATUS_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+)
 
 
 def setup_env():
@@ -41,10 +61,7 @@ def setup_env():
 
     env = os.environ.copy()
     venv_path = Path(sys.executable).parent
-    if platform.system() == "Windows":
-        env["PATH"] = f"{venv_path};{env['PATH']}"
-    else:
-        env["PATH"] = f"{venv_path}:{env['PATH']}"
+    env["PATH"] = f"{venv_path}{os.pathsep}{env['PATH']}"
     return env
 
 
@@ -54,27 +71,42 @@ def optimum_cli(
     env: Dict[str, str],
     additional_args: Dict[str, str] = None,
 ):
-    if args.repo_source == "huggingface":
-        export_command = (
-            f"optimum-cli export openvino --model {args.model_name} {output_dir}"
-        )
-    else:
-        export_command = (
-            f"optimum-cli export openvino --model {output_dir} {output_dir}"
-        )
+    model = args.model_name if args.repo_source == "huggingface" else output_dir
+    # Resolve against env's PATH so the command runs without a shell on Windows too
+    optimum = shutil.which("optimum-cli", path=env.get("PATH")) or "optimum-cli"
+    export_command = [
+        optimum,
+        "export",
+        "openvino",
+        "--model",
+        str(model),
+        str(output_dir),
+    ]
     if additional_args is not None:
         for arg, value in additional_args.items():
-            export_command += f" --{arg}"
+            export_command.append(f"--{arg}")
             if value:
-                export_command += f" {value}"
+                export_command.append(str(value))
     try:
-        subprocess.run(
-            export_command.split(" "),
-            shell=(platform.system() == "Windows"),
-            check=True,
-            capture_output=True,
+        # Stream the export output to the log instead of buffering all of it,
+        # only the last lines are kept for the error message
+        output_tail = collections.deque(maxlen=200)
+        with subprocess.Popen(
+            export_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
             env=env,
-        )
+        ) as process:
+            for line in process.stdout:
+                line = line.rstrip()
+                logging.info(line)
+                output_tail.append(line)
+        if process.returncode != 0:
+            logging.error("\n".join(output_tail))
+            raise subprocess.CalledProcessError(process.returncode, export_command)
     except Exception as e:
         logging.error(f"optimum-cli failed: {e}")
         update_payload_status(args.id, status="failed", port=args.port)
@@ -117,17 +149,110 @@ def update_payload_status(workload_id: int, status: str, port: int):
 
     data = {"status": status, "port": port}
     try:
-        response = requests.patch(url, json=data)
+        response = STATUS_SESSION.patch(url, json=data, timeout=5)
         response.raise_for_status()
         logging.info(f"Successfully updated status to {status} for {workload_id}.")
     except requests.exceptions.RequestException as e:
         logging.info(f"Failed to update status: {e}")
 
 
+def extract_file(zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, target: Path):
+    """
+    Stream a single zip member to disk in 1 MiB chunks.
+    """
+    with zip_ref.open(member) as src, open(target, "wb") as dst:
+        if member.file_size and hasattr(os, "posix_fallocate"):
+            try:
+                # Reserve the full size up front to avoid fragmented writes
+                os.posix_fallocate(dst.fileno(), 0, member.file_size)
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+
+def extract_zip(zip_path: Path, destination: Path):
+    """
+    Extract a zip archive in parallel, refusing it when any member would be
+    written outside destination.
+    """
+    destination = destination.resolve()
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        files = []
+        directories = {destination}
+        for member in zip_ref.infolist():
+            target = (destination / member.filename).resolve()
+            if not target.is_relative_to(destination):
+                raise ValueError(f"Zip member {member.filename} escapes {destination}")
+            if member.is_dir():
+                directories.add(target)
+            else:
+                directories.add(target.parent)
+                files.append((member, target))
+
+        # Create all directories up front, parents first
+        for directory in sorted(directories, key=lambda path: len(path.parts)):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        # The threads share one archive handle, its lock only covers reading the
+        # compressed bytes and zlib inflates outside it with the GIL released.
+        # Largest members go first so no thread is left with a big one at the end
+        files.sort(key=lambda file: file[0].file_size, reverse=True)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(lambda file: extract_file(zip_ref, *file), files))
+
+
+def probe_directory(path: Path):
+    """
+    Return whether path exists and whether it has any entries, reading at most
+    one directory entry.
+    """
+    try:
+        with os.scandir(path) as entries:
+            return True, next(entries, None) is not None
+    except FileNotFoundError:
+        return False, False
+    except NotADirectoryError:
+        return True, True
+
+
+def prefetch_model_files(model_path: Path):
+    """
+    Ask the kernel to read the model files into the page cache ahead of the
+    pipeline constructor. No-op where posix_fadvise is unavailable (Windows).
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in model_path.rglob("*"):
+        if path.suffix not in MODEL_FILE_SUFFIXES or not path.is_file():
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def pipeline_properties(device: str):
+    """
+    Return the OpenVINO properties used to construct the pipeline on the device.
+    """
+    # Only GPU/NPU plugins spend long compiling the graph on every start, CPU
+    # loads the IR directly so a cached blob would just be a second copy
+    if any(accelerator in device.upper() for accelerator in ("GPU", "NPU")):
+        return {"CACHE_DIR": str(OV_CACHE_DIR)}
+    return {}
+
+
 def setup_model(args: argparse.Namespace, env: Dict[str, str]):
     global PIPE
     # Prepare model path and extraction if needed
     MODELS_DIR.mkdir(exist_ok=True)
+    OV_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     # handle custom model in zip format
     if args.model_name.endswith(".zip"):
@@ -138,8 +263,7 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         if not model_path.exists():
             logging.info(f"Extracting {args.model_name} to {model_path}")
             try:
-                with zipfile.ZipFile(Path(args.model_name).resolve(), "r") as zip_ref:
-                    zip_ref.extractall(model_path)
+                extract_zip(Path(args.model_name).resolve(), model_path)
             except Exception as e:
                 logging.error(f"Failed to extract zip file {args.model_name}: {e}")
                 update_payload_status(args.id, status="failed", port=args.port)
@@ -151,23 +275,25 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
     else:
         # handle custom model uploaded to directory
         model_path = CUSTOM_MODEL_DIR / args.model_name
+        custom_model_exists, custom_model_has_files = probe_directory(model_path)
 
-        if not model_path.exists():
+        if not custom_model_exists:
             # predefined model or hugging face model id
             model_path = MODELS_DIR / args.model_name
-            if platform.system() == "Windows":
+            if IS_WINDOWS:
                 model_path = Path.cwd() / model_path
             logging.info(f"Model: {model_path}")
         else:
             logging.info(f"Custom model found: {model_path}")
             model_path = model_path.resolve()
-            if not any(model_path.iterdir()):
+            if not custom_model_has_files:
                 logging.error(f"Custom model directory {model_path} is empty.")
                 update_payload_status(args.id, status="failed", port=args.port)
                 sys.exit(1)
 
     # download model if it doesn't exist
-    if model_path.exists() and not any(model_path.iterdir()):
+    model_exists, model_has_files = probe_directory(model_path)
+    if model_exists and not model_has_files:
         logging.info(f"Removing empty model directory: {model_path}")
         try:
             model_path.rmdir()
@@ -175,12 +301,14 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
             logging.warning(f"Failed to remove empty directory {model_path}: {e}")
             update_payload_status(args.id, status="failed", port=args.port)
             sys.exit(1)
+        model_exists = False
 
-    if not model_path.exists():
+    if not model_exists:
         logging.info(f"Model {model_path} not found. Downloading...")
 
+        model_name = args.model_name.lower()
         is_openvino_model = any(
-            keyword in args.model_name.lower() for keyword in ["openvino", "ov"]
+            keyword in model_name for keyword in OPENVINO_MODEL_KEYWORDS
         )
 
         try:
@@ -188,6 +316,10 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
                 logging.info(
                     f"Downloading model {args.model_name} from ModelScope to {model_path}"
                 )
+                # The hub clients are only needed on a cold start, so they are
+                # imported here instead of slowing down every worker launch
+                from modelscope.hub.snapshot_download import snapshot_download
+
                 snapshot_download(
                     repo_id=args.model_name,
                     local_dir=str(model_path),
@@ -209,6 +341,8 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
                 )
 
                 if is_openvino_model:
+                    import huggingface_hub
+
                     huggingface_hub.snapshot_download(
                         args.model_name, local_dir=str(model_path)
                     )
@@ -226,17 +360,23 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
             update_payload_status(args.id, status="failed", port=args.port)
             sys.exit(1)
 
-    if (
-        model_path.resolve() != model_path.absolute()
-    ):  # Check if the model path is a symlink
+    # Check if the model path is a symlink
+    if os.path.realpath(model_path) != os.path.abspath(model_path):
         logging.error(
             f"Model file {model_path} is a symlink or contains a symlink in its path. Refusing to open for security reasons."
         )
         update_payload_status(args.id, status="failed", port=args.port)
         sys.exit(1)
 
+    # Warm the page cache in the background while OpenVINO initializes
+    threading.Thread(
+        target=prefetch_model_files, args=(model_path,), daemon=True
+    ).start()
+
     try:
-        PIPE = openvino_genai.LLMPipeline(str(model_path), args.device)
+        PIPE = openvino_genai.LLMPipeline(
+            str(model_path), args.device, **pipeline_properties(args.device)
+        )
         update_payload_status(args.id, status="active", port=args.port)
     except Exception as e:
         logging.error(f"Failed to load model: {e}")
@@ -244,6 +384,70 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         sys.exit(1)
 
 
+def load_model(args: argparse.Namespace, env: Dict[str, str]):
+    """
+    Run setup_model off the event loop so uvicorn can accept connections
+    while the model is downloaded and loaded.
+    """
+    try:
+        setup_model(args, env)
+    except SystemExit as e:
+        # sys.exit() only ends this thread, the failed status is already reported
+        os._exit(e.code)
+    except Exception as e:
+        logging.error(f"Failed to set up the model: {e}")
+        update_payload_status(args.id, status="failed", port=args.port)
+        os._exit(1)
+
+
+def generate_text(pipe: openvino_genai.LLMPipeline, prompts, max_tokens: int):
+    """
+    Run a blocking generation on the pipeline, called from the thread pool.
+    """
+    with PIPE_LOCK:
+        return pipe.generate(prompts, max_new_tokens=max_tokens)
+
+
+async def batch_requests(queue: asyncio.Queue, max_batch_size: int):
+    """
+    Collect queued (request, future) pairs for up to MAX_BATCH_WAIT_S and run
+    them as batched generations. Only prompts with the same max_tokens share a
+    batch so every request keeps its own token limit. The perf metrics of a
+    batched generation describe the whole batch and are returned to every
+    request in it.
+    """
+    loop = asyncio.get_running_loop()
+    while True:
+        batch = [await queue.get()]
+        deadline = loop.time() + MAX_BATCH_WAIT_S
+        while len(batch) < max_batch_size:
+            timeout = deadline - loop.time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+
+        groups = collections.defaultdict(list)
+        for request, future in batch:
+            groups[request.max_tokens].append((request, future))
+
+        for max_tokens, group in groups.items():
+            prompts = [request.prompt for request, _ in group]
+            try:
+                res = await run_in_threadpool(generate_text, PIPE, prompts, max_tokens)
+            except Exception as e:
+                for _, future in group:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            for text, (_, future) in zip(res.texts, group):
+                # The caller may have disconnected and cancelled its future
+                if not future.done():
+                    future.set_result((text, res.perf_metrics))
+
+
 class Request(BaseModel):
     prompt: str
     max_tokens: int = 100
@@ -277,17 +481,39 @@ def parse_args():
     parser.add_argument(
         "--id", type=int, default=1, help="Workload ID to update the workload status"
     )
+    parser.add_argument(
+        "--max-batch-size",
+        type=int,
+        default=1,
+        help="Maximum concurrent prompts generated together (default: 1). Above 1 "
+        "the reported metrics are for the whole batch, not per request",
+    )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    # Model ids are joined onto the model directories, so they must stay relative
+    if not args.model_name.endswith(".zip"):
+        model_name = Path(args.model_name)
+        if model_name.is_absolute() or ".." in model_name.parts:
+            update_payload_status(args.id, status="failed", port=args.port)
+            parser.error(f"Invalid model name: {args.model_name}")
+    return args
 
 
 def create_app(args: argparse.Namespace, env: Dict[str, str]):
     @asynccontextmanager
     async def lifespan(app: FastAPI):
-        setup_model(args, env)
+        thread = threading.Thread(target=load_model, args=(args, env), daemon=True)
+        thread.start()
+        app.state.infer_queue = asyncio.Queue()
+        # Batched generation is only supported on CPU and GPU, NPU runs batch size 1
+        max_batch_size = 1 if "NPU" in args.device.upper() else args.max_batch_size
+        batch_task = asyncio.create_task(
+            batch_requests(app.state.infer_queue, max_batch_size)
+        )
         yield
+        batch_task.cancel()
 
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
     app.add_middleware(
         CORSMiddleware,
@@ -297,21 +523,27 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
         allow_headers=["*"],
     )
 
+    @app.get("/health")
+    async def health():
+        return {"ready": PIPE is not None}
+
     @app.post("/infer")
     async def start_chatting(request: Request):
-        global PIPE
         try:
-            res = PIPE.generate([request.prompt], max_new_tokens=request.max_tokens)
+            # The batching task generates off the event loop and resolves the future
+            future = asyncio.get_running_loop().create_future()
+            await app.state.infer_queue.put((request, future))
+            text, perf_metrics = await future
 
-            load_time_s = round((res.perf_metrics.get_load_time() / 1e3), 2)
+            load_time_s = round((perf_metrics.get_load_time() / 1e3), 2)
             generation_time_s = round(
-                (res.perf_metrics.get_generate_duration().mean / 1e3), 2
+                (perf_metrics.get_generate_duration().mean / 1e3), 2
             )
-            ttft_s = round((res.perf_metrics.get_ttft().mean / 1e3), 2)
-            throughput_tokens_s = round(res.perf_metrics.get_throughput().mean, 2)
+            ttft_s = round((perf_metrics.get_ttft().mean / 1e3), 2)
+            throughput_tokens_s = round(perf_metrics.get_throughput().mean, 2)
 
             return {
-                "text": str(res),
+                "text": text,
                 "load_time_s": load_time_s,
                 "generation_time_s": generation_time_s,
                 "time_to_token_s": ttft_s,
@@ -319,7 +551,7 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
             }
         except Exception as e:
             logging.error(f"Error starting the chat: {e}")
-            return JSONResponse(
+            return ORJSONResponse(
                 {
                     "status": False,
                     "message": "An error occurred while starting the chat",
@@ -339,4 +571,6 @@ if __name__ == "__main__":
         app,
         host="127.0.0.1",
         port=args.port,
+        loop="asyncio" if IS_WINDOWS else "uvloop",
+        http="httptools",
     )
@@ -5,18 +5,21 @@ import os
 import io
 import sys
 import time
+import shutil
 import base64
 import logging
 import zipfile
 import uvicorn
 import requests
 import argparse
+import threading
 import platform
+import collections
 import subprocess
 import urllib.parse
 import openvino_genai
-import huggingface_hub
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
 
 import soundfile as sf
 from typing import Dict
@@ -24,9 +27,9 @@ from fastapi import FastAPI
 from pydantic import BaseModel
 from dotenv import load_dotenv
 from contextlib import asynccontextmanager
-from fastapi.responses import JSONResponse
+from fastapi.responses import ORJSONResponse, Response
 from fastapi.middleware.cors import CORSMiddleware
-from modelscope.hub.snapshot_download import snapshot_download
+from starlette.concurrency import run_in_threadpool
 
 
 logging.basicConfig(
@@ -35,9 +38,21 @@ logging.basicConfig(
 )
 
 MODELS_DIR = Path("models")
+OV_CACHE_DIR = MODELS_DIR / "ov_cache"
 CUSTOM_MODEL_DIR = Path("../custom_models/text-to-speech")
 ENV_PATH = Path("../../frontend/.env")
 PIPE = None
+# Model files read ahead before the pipeline opens them
+MODEL_FILE_SUFFIXES = (".bin", ".xml", ".onnx")
+# Substrings marking a repo that already ships OpenVINO IR
+OPENVINO_MODEL_KEYWORDS = ("openvino", "ov")
+# Reused for every status update so the TCP connection to the backend is kept alive
+STATUS_SESSION = requests.Session()
+STATUS_SESSION.mount(
+    "http://", requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=4)
+)
+# Text2SpeechPipeline is not re-entrant, generations run one at a time
+PIPE_LOCK = threading.Lock()
 
 
 def setup_env():
@@ -58,27 +73,42 @@ def optimum_cli(
     env: Dict[str, str],
     additional_args: Dict[str, str] = None,
 ):
-    if args.repo_source == "huggingface":
-        export_command = (
-            f"optimum-cli export openvino --model {args.model_name} {output_dir}"
-        )
-    else:
-        export_command = (
-            f"optimum-cli export openvino --model {output_dir} {output_dir}"
-        )
+    model = args.model_name if args.repo_source == "huggingface" else output_dir
+    # Resolve against env's PATH so the command runs without a shell on Windows too
+    optimum = shutil.which("optimum-cli", path=env.get("PATH")) or "optimum-cli"
+    export_command = [
+        optimum,
+        "export",
+        "openvino",
+        "--model",
+        str(model),
+        str(output_dir),
+    ]
     if additional_args is not None:
         for arg, value in additional_args.items():
-            export_command += f" --{arg}"
+            export_command.append(f"--{arg}")
             if value:
-                export_command += f" {value}"
+                export_command.append(str(value))
     try:
-        subprocess.run(
-            export_command.split(" "),
-            shell=(platform.system() == "Windows"),
-            check=True,
-            capture_output=True,
+        # Stream the export output to the log instead of buffering all of it,
+        # only the last lines are kept for the error message
+        output_tail = collections.deque(maxlen=200)
+        with subprocess.Popen(
+            export_command,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+            errors="replace",
+            bufsize=1,
             env=env,
-        )
+        ) as process:
+            for line in process.stdout:
+                line = line.rstrip()
+                logging.info(line)
+                output_tail.append(line)
+        if process.returncode != 0:
+            logging.error("\n".join(output_tail))
+            raise subprocess.CalledProcessError(process.returncode, export_command)
     except Exception as e:
         logging.error(f"optimum-cli failed: {e}")
         update_payload_status(args.id, status="failed", port=args.port)
@@ -121,17 +151,107 @@ def update_payload_status(workload_id: int, status: str, port: int):
 
     data = {"status": status, "port": port}
     try:
-        response = requests.patch(url, json=data)
+        response = STATUS_SESSION.patch(url, json=data, timeout=5)
         response.raise_for_status()
         logging.info(f"Successfully updated status to {status} for {workload_id}.")
     except requests.exceptions.RequestException as e:
         logging.info(f"Failed to update status: {e}")
 
 
+def extract_file(zip_ref: zipfile.ZipFile, member: zipfile.ZipInfo, target: Path):
+    """
+    Stream a single zip member to disk in 1 MiB chunks.
+    """
+    with zip_ref.open(member) as src, open(target, "wb") as dst:
+        if member.file_size and hasattr(os, "posix_fallocate"):
+            try:
+                # Reserve the full size up front to avoid fragmented writes
+                os.posix_fallocate(dst.fileno(), 0, member.file_size)
+            except OSError:
+                pass
+        shutil.copyfileobj(src, dst, 1 << 20)
+
+
+def extract_zip(zip_path: Path, destination: Path):
+    """
+    Extract a zip archive in parallel, refusing it when any member would be
+    written outside destination.
+    """
+    destination = destination.resolve()
+    with zipfile.ZipFile(zip_path, "r") as zip_ref:
+        files = []
+        directories = {destination}
+        for member in zip_ref.infolist():
+            target = (destination / member.filename).resolve()
+            if not target.is_relative_to(destination):
+                raise ValueError(f"Zip member {member.filename} escapes {destination}")
+            if member.is_dir():
+                directories.add(target)
+            else:
+                directories.add(target.parent)
+                files.append((member, target))
+
+        # Create all directories up front, parents first
+        for directory in sorted(directories, key=lambda path: len(path.parts)):
+            directory.mkdir(parents=True, exist_ok=True)
+
+        # One shared handle is enough, members inflate concurrently outside its
+        # read lock. Start with the largest members to balance the threads
+        files.sort(key=lambda file: file[0].file_size, reverse=True)
+        with ThreadPoolExecutor(max_workers=os.cpu_count()) as executor:
+            list(executor.map(lambda file: extract_file(zip_ref, *file), files))
+
+
+def probe_directory(path: Path):
+    """
+    Return (exists, has_entries) for path from one scandir call.
+    """
+    try:
+        with os.scandir(path) as entries:
+            return True, next(entries, None) is not None
+    except FileNotFoundError:
+        return False, False
+    except NotADirectoryError:
+        return True, True
+
+
+def prefetch_model_files(model_path: Path):
+    """
+    Start kernel readahead of the speech model and vocoder files, on platforms
+    with posix_fadvise.
+    """
+    if not hasattr(os, "posix_fadvise"):
+        return
+    for path in model_path.rglob("*"):
+        if path.suffix not in MODEL_FILE_SUFFIXES or not path.is_file():
+            continue
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            continue
+        try:
+            os.posix_fadvise(fd, 0, 0, os.POSIX_FADV_WILLNEED)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+
+def pipeline_properties(device: str):
+    """
+    Return the OpenVINO properties for the Text2SpeechPipeline on device, a
+    compiled blob cache on GPU/NPU and nothing on CPU.
+    """
+    if any(accelerator in device.upper() for accelerator in ("GPU", "NPU")):
+        return {"CACHE_DIR": str(OV_CACHE_DIR)}
+    return {}
+
+
 def setup_model(args: argparse.Namespace, env: Dict[str, str]):
     global PIPE
     # Prepare model path and extraction if needed
     MODELS_DIR.mkdir(exist_ok=True)
+    OV_CACHE_DIR.mkdir(parents=True, exist_ok=True)
 
     # handle custom model in zip format
     if args.model_name.endswith(".zip"):
@@ -142,8 +262,7 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         if not model_path.exists():
             logging.info(f"Extracting {args.model_name} to {model_path}")
             try:
-                with zipfile.ZipFile(Path(args.model_name).resolve(), "r") as zip_ref:
-                    zip_ref.extractall(model_path)
+                extract_zip(Path(args.model_name).resolve(), model_path)
             except Exception as e:
                 logging.error(f"Failed to extract zip file {args.model_name}: {e}")
                 update_payload_status(args.id, status="failed", port=args.port)
@@ -155,8 +274,9 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
     else:
         # handle custom model uploaded to directory
         model_path = CUSTOM_MODEL_DIR / args.model_name
+        custom_model_exists, custom_model_has_files = probe_directory(model_path)
 
-        if not model_path.exists():
+        if not custom_model_exists:
             # predefined model or hugging face model id
             model_path = MODELS_DIR / args.model_name
             if platform.system() == "Windows":
@@ -165,13 +285,14 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         else:
             logging.info(f"Custom model found: {model_path}")
             model_path = model_path.resolve()
-            if not any(model_path.iterdir()):
+            if not custom_model_has_files:
                 logging.error(f"Custom model directory {model_path} is empty.")
                 update_payload_status(args.id, status="failed", port=args.port)
                 sys.exit(1)
 
     # download model if it doesn't exist
-    if model_path.exists() and not any(model_path.iterdir()):
+    model_exists, model_has_files = probe_directory(model_path)
+    if model_exists and not model_has_files:
         logging.info(f"Removing empty model directory: {model_path}")
         try:
             model_path.rmdir()
@@ -179,12 +300,14 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
             logging.warning(f"Failed to remove empty directory {model_path}: {e}")
             update_payload_status(args.id, status="failed", port=args.port)
             sys.exit(1)
+        model_exists = False
 
-    if not model_path.exists():
+    if not model_exists:
         logging.info(f"Model {model_path} not found. Downloading...")
 
+        model_name = args.model_name.lower()
         is_openvino_model = any(
-            keyword in args.model_name.lower() for keyword in ["openvino", "ov"]
+            keyword in model_name for keyword in OPENVINO_MODEL_KEYWORDS
         )
 
         try:
@@ -192,6 +315,10 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
                 logging.info(
                     f"Downloading model {args.model_name} from ModelScope to {model_path}"
                 )
+                # The hub clients are only needed on a cold start, so they are
+                # imported here instead of slowing down every worker launch
+                from modelscope.hub.snapshot_download import snapshot_download
+
                 snapshot_download(
                     repo_id=args.model_name,
                     local_dir=str(model_path),
@@ -209,6 +336,8 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
                 )
 
                 if is_openvino_model:
+                    import huggingface_hub
+
                     huggingface_hub.snapshot_download(
                         args.model_name, local_dir=str(model_path)
                     )
@@ -223,17 +352,23 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
             update_payload_status(args.id, status="failed", port=args.port)
             sys.exit(1)
 
-    if (
-        model_path.resolve() != model_path.absolute()
-    ):  # Check if the model path is a symlink
+    # Check if the model path is a symlink
+    if os.path.realpath(model_path) != os.path.abspath(model_path):
         logging.error(
             f"Model file {model_path} is a symlink or contains a symlink in its path. Refusing to open for security reasons."
         )
         update_payload_status(args.id, status="failed", port=args.port)
         sys.exit(1)
 
+    # Readahead runs alongside the pipeline constructor
+    threading.Thread(
+        target=prefetch_model_files, args=(model_path,), daemon=True
+    ).start()
+
     try:
-        PIPE = openvino_genai.Text2SpeechPipeline(str(model_path), args.device)
+        PIPE = openvino_genai.Text2SpeechPipeline(
+            str(model_path), args.device, **pipeline_properties(args.device)
+        )
         update_payload_status(args.id, status="active", port=args.port)
     except Exception as e:
         logging.error(f"Error loading model: {e}")
@@ -241,6 +376,32 @@ def setup_model(args: argparse.Namespace, env: Dict[str, str]):
         sys.exit(1)
 
 
+def synthesize_speech(
+    pipe: openvino_genai.Text2SpeechPipeline, text: str, as_base64: bool = True
+):
+    """
+    Generate speech as WAV, called from the thread pool.
+    Return the audio (base64 string, or raw bytes when as_base64 is False)
+    and the inference time in seconds.
+    """
+    with PIPE_LOCK:
+        start_time = time.perf_counter()
+        result = pipe.generate(text)
+        inference_time = time.perf_counter() - start_time
+
+    assert (
+        len(result.speeches) == 1
+    ), "Expected only one waveform for the requested input text"
+    speech = result.speeches[0]
+    audio_byte_arr = io.BytesIO()
+    sf.write(audio_byte_arr, speech.data[0], samplerate=16000, format="WAV")
+    if not as_base64:
+        return audio_byte_arr.getvalue(), inference_time
+    # getbuffer() exposes the WAV bytes without copying them out of the buffer
+    audio_base64 = base64.b64encode(audio_byte_arr.getbuffer()).decode("ascii")
+    return audio_base64, inference_time
+
+
 class Request(BaseModel):
     text: str  # Input text for which to generate speech
 
@@ -274,7 +435,14 @@ def parse_args():
         "--id", type=int, default=1, help="Workload ID to update the workload status"
     )
 
-    return parser.parse_args()
+    args = parser.parse_args()
+    # Model ids are joined onto the model directories, so they must stay relative
+    if not args.model_name.endswith(".zip"):
+        model_name = Path(args.model_name)
+        if model_name.is_absolute() or ".." in model_name.parts:
+            update_payload_status(args.id, status="failed", port=args.port)
+            parser.error(f"Invalid model name: {args.model_name}")
+    return args
 
 
 def create_app(args: argparse.Namespace, env: Dict[str, str]):
@@ -283,7 +451,7 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
         setup_model(args, env)
         yield
 
-    app = FastAPI(lifespan=lifespan)
+    app = FastAPI(lifespan=lifespan, default_response_class=ORJSONResponse)
 
     app.add_middleware(
         CORSMiddleware,
@@ -294,32 +462,32 @@ def create_app(args: argparse.Namespace, env: Dict[str, str]):
     )
 
     @app.post("/infer")
-    async def generate_speech(request: Request):
-        global PIPE
+    async def generate_speech(request: Request, encoding: str = "base64"):
+        pipe = PIPE
         try:
-            start_time = time.perf_counter()
-            result = PIPE.generate(request.text)
-            inference_time = time.perf_counter() - start_time
-
-            assert (
-                len(result.speeches) == 1
-            ), "Expected only one waveform for the requested input text"
-            speech = result.speeches[0]
-            audio_byte_arr = io.BytesIO()
-            sf.write(audio_byte_arr, speech.data[0], samplerate=16000, format="WAV")
-            audio_byte_arr.seek(0)
-            audio_base64 = base64.b64encode(audio_byte_arr.read()).decode("utf-8")
+            # Keep the event loop free while the model generates and the WAV is encoded
+            audio, inference_time = await run_in_threadpool(
+                synthesize_speech, pipe, request.text, encoding != "wav"
+            )
 
             generation_time_s = round(inference_time, 1)
 
+            # ?encoding=wav returns the raw WAV body, skipping the base64 overhead
+            if encoding == "wav":
+                return Response(
+                    content=audio,
+                    media_type="audio/wav",
+                    headers={"X-Generation-Time-S": str(generation_time_s)},
+                )
+
             return {
                 "generation_time_s": generation_time_s,
-                "audio": audio_base64,
+                "audio": audio,
             }
 
         except Exception as e:
             logging.error(f"Error generating the speech: {e}")
-            return JSONResponse(
+            return ORJSONResponse(
                 {
                     "status": False,
                     "message": "An error occurred while generating the speech",
@@ -339,4 +507,6 @@ if __name__ == "__main__":
         app,
         host="127.0.0.1",
         port=args.port,
+        loop="asyncio" if platform.system() == "Windows" else "uvloop",
+        http="httptools",
     )